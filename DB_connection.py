@@ -1,5 +1,7 @@
 from dotenv import load_dotenv
+from instrumentation import call
 import os
+import threading
 
 import pandas as pd
 import sqlite3
@@ -7,48 +9,204 @@ from tqdm import tqdm
 
 load_dotenv()
 
+# Sub-folder of DATA_PATH containing the database of each dataset
+DATASET_FOLDERS = {
+    "POLIFACT": "Polifact/",
+    "GOSSIPCOP": "GossipCop/",
+    "LIAR": "LIAR/",
+}
+
+# Pragmas applied to every new connection (can be overridden with the "pragmas" argument)
+# WAL lets analysis scripts keep reading while a scraper or a translator is writing
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "mmap_size": 268435456,  # 256 MB
+    "cache_size": -65536,  # Negative value = size in KB (64 MB)
+    "busy_timeout": 30000,  # Wait up to 30 s for a lock instead of failing immediately
+}
+
+# Pragmas that modify the database file and therefore cannot be applied to a read-only connection
+WRITE_ONLY_PRAGMAS = {"journal_mode"}
+
+
 class DB_connection:
 
-    def __init__(self,dataset):
-        # dataset is either POLIFACT, LIAR or GOSSIPCOP --> In our work, we only use GOSSIPCOP
+    def __init__(self, dataset, read_only=False, immutable=False, pragmas=None):
+        """
+        Args:
+         -  dataset (str): Either POLIFACT, LIAR or GOSSIPCOP --> In our work, we only use GOSSIPCOP
+         -  read_only (bool): Open the database in read-only mode (query_only), as used by the analysis scripts.
+         -  immutable (bool): Read-only mode in which SQLite skips all locking. Only safe when no other
+            process writes to the database while the connection is open (changes still in the WAL file
+            of a running writer are not visible).
+         -  pragmas (dict): Pragmas overriding DEFAULT_PRAGMAS (a value of None disables a pragma).
+
+        Each thread gets its own sqlite3 connection, created lazily with the same settings,
+        so a DB_connection can be shared by the workers of a thread pool. Processes must create
+        their own DB_connection.
+        """
+        if dataset not in DATASET_FOLDERS:
+            raise ValueError(f"Unknown dataset: {dataset}")
+
         path_to_data = os.getenv("DATA_PATH")
-        if dataset == "POLIFACT":
-            self.connection = sqlite3.connect(path_to_data + "Polifact/"  + "database.db")
-            self.cursor = self.connection.cursor()
-        elif dataset == "GOSSIPCOP":
-            self.connection = sqlite3.connect(path_to_data + "GossipCop/"  + "database.db")
-            self.cursor = self.connection.cursor()
-        elif dataset == "LIAR":
-            self.connection = sqlite3.connect(path_to_data + "LIAR/"  + "database.db")
-            self.cursor = self.connection.cursor()
+        self.dataset = dataset
+        self.data_dir = path_to_data + DATASET_FOLDERS[dataset]
+        self.path = self.data_dir + "database.db"
+        self.read_only = read_only or immutable
+        self.immutable = immutable
+
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        if pragmas:
+            self.pragmas.update(pragmas)
+
+        self._local = threading.local()
+        self._connections = {}  # Connection of each thread
+        self._lock = threading.Lock()
+
+        # Open the connection of the calling thread immediately so that errors surface here
+        self._local.connection = self._connect()
+
+    def _connect(self):
+        if self.read_only:
+            mode = "immutable=1" if self.immutable else "mode=ro"
+            uri = f"file:{os.path.abspath(self.path)}?{mode}"
+            connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+
+        for name, value in self.pragmas.items():
+            if value is None or (self.read_only and name in WRITE_ONLY_PRAGMAS):
+                continue
+            connection.execute(f"PRAGMA {name} = {value}")
+
+        if self.read_only:
+            connection.execute("PRAGMA query_only = ON")
+
+        with self._lock:
+            self._close_exited_threads()
+            self._connections[threading.current_thread()] = connection
+        return connection
+
+    def _close_exited_threads(self):
+        # Connections of the threads that have exited (e.g. the workers of a finished thread pool)
+        for thread in [thread for thread in self._connections if not thread.is_alive()]:
+            self._connections.pop(thread).close()
+
+    @property
+    def connection(self):
+        # Connection of the calling thread
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._connect()
+            self._local.connection = connection
+        return connection
+
+    @property
+    def cursor(self):
+        return self.connection.cursor()
 
     def execute(self,query, params=None, commit = True):
         cursor = self.connection.cursor()
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
-        if commit == True:
-            self.connection.commit()    
-        return cursor.fetchall()
-    
+        with call("db.execute"):
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+            if commit == True:
+                self.connection.commit()
+            return cursor.fetchall()
+
+    def executemany(self, query, rows, commit=True):
+        """
+        Runs the same statement for every parameter tuple of "rows" (any iterable, including generators)
+        in a single call. Returns the number of rows affected.
+        """
+        cursor = self.connection.cursor()
+        with call("db.executemany"):
+            cursor.executemany(query, rows)
+            if commit:
+                self.connection.commit()
+        return cursor.rowcount
+
+    def insert_many(self, table_name, columns, rows, on_conflict="IGNORE", commit=True):
+        """
+        Bulk insert of "rows" (sequence of tuples ordered as "columns") into "table_name".
+
+        Args:
+         -  on_conflict (str): SQLite conflict resolution (IGNORE, REPLACE, ABORT...), None for a plain INSERT.
+        """
+        verb = f"INSERT OR {on_conflict}" if on_conflict else "INSERT"
+        placeholders = ", ".join("?" for _ in columns)
+        query = f"{verb} INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+        return self.executemany(query, rows, commit=commit)
+
+    def update_many(self, table_name, columns, rows, key="rowid", commit=True):
+        """
+        Batched write-back: each tuple of "rows" contains the new values of "columns" followed by the value of "key"
+        identifying the row to update.
+        """
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        query = f"UPDATE {table_name} SET {assignments} WHERE {key} = ?"
+        return self.executemany(query, rows, commit=commit)
+
+    def iter_chunks(self, table_name, columns, chunk_size=1000, key="rowid", where=None, params=(), as_frame=True):
+        """
+        Streams "table_name" in chunks of at most "chunk_size" rows using keyset pagination on "key"
+        (rowid or a single-column primary key): each page starts right after the last key of the previous one,
+        so the whole scan is linear, unlike LIMIT/OFFSET which re-walks every skipped row.
+
+        Args:
+         -  where (str): Optional SQL condition applied to the rows (with "params" as its parameters).
+         -  as_frame (bool): Yield DataFrames (key column first) instead of lists of tuples (key value first).
+
+        Rows can be updated (e.g. with update_many) between two chunks without disturbing the iteration.
+        """
+        select = f"SELECT {key}, {', '.join(columns)} FROM {table_name}"
+        condition = f" AND ({where})" if where else ""
+        first_query = f"{select} WHERE 1{condition} ORDER BY {key} LIMIT ?"
+        next_query = f"{select} WHERE {key} > ?{condition} ORDER BY {key} LIMIT ?"
+
+        cursor = self.connection.cursor()
+        with call("db.iter_chunks"):
+            rows = cursor.execute(first_query, (*params, chunk_size)).fetchall()
+        while rows:
+            if as_frame:
+                yield pd.DataFrame.from_records(rows, columns=[key] + list(columns))
+            else:
+                yield rows
+            if len(rows) < chunk_size:
+                break
+            with call("db.iter_chunks"):
+                rows = cursor.execute(next_query, (rows[-1][0], *params, chunk_size)).fetchall()
+
     def commit(self):
-        self.connection.commit()
-    
-    def select(self,query):
-        return pd.read_sql_query(query, self.connection)
-        
+        with call("db.commit"):
+            self.connection.commit()
+
+    def select(self,query, params=None):
+        with call("db.select"):
+            return pd.read_sql_query(query, self.connection, params=params)
+
     def select_single_value(self,query):
         cursor = self.connection.cursor()
-        cursor.execute(query)
-        result = cursor.fetchone()
+        with call("db.execute"):
+            cursor.execute(query)
+            result = cursor.fetchone()
         return result[0]
 
+    def column_names(self, table_name):
+        # table_xinfo also lists generated columns
+        return [row[1] for row in self.execute(f"PRAGMA table_xinfo({table_name})", commit=False)]
+
     def save_df(self,df,table_name):
         df.to_sql(table_name, self.connection, if_exists="replace", index =False)
 
     def close(self):
-        self.connection.close()
-
-
-
+        # Close the connections opened by every thread
+        with self._lock:
+            connections, self._connections = list(self._connections.values()), {}
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
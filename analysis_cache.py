@@ -0,0 +1,267 @@
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from DB_connection import DB_connection
+
+CACHE_FOLDER = "analysis_cache/"
+VERSIONS_TABLE = "table_versions"
+TRACKED_EVENTS = ["INSERT", "UPDATE", "DELETE"]
+
+# Tables exported for the analysis scripts.
+#  -  query: rows exported (in this order)
+#  -  columns: storage of each column: "category" (integer codes + list of values), "text" (one UTF-8 buffer
+#     + offsets) or "number" (float64/int64 array)
+#  -  source_tables: tables whose modification invalidates the export
+ANALYSIS_TABLES = {
+    "timelines": {
+        "query": """
+            SELECT username, label, tweet_id, tweet_type, text_translation, quoted_translation,
+                   tweet_created_at, replies, retweets
+            FROM filtered_user_timelines
+        """,
+        "columns": {
+            "username": "category",
+            "label": "category",
+            "tweet_id": "text",
+            "tweet_type": "category",
+            "text_translation": "text",
+            "quoted_translation": "text",
+            "tweet_created_at": "text",
+            "replies": "number",
+            "retweets": "number",
+        },
+        "source_tables": ["filtered_user_timelines_data", "filtered_users"],
+    },
+    "users": {
+        "query": """
+            SELECT username, label, COALESCE(json_valid(full_data), 0) AS has_data,
+                   is_blue_verified, account_created_at,
+                   tweet_count, favor_count, follower_count, following_count
+            FROM users
+            WHERE username IN (SELECT username FROM filtered_users)
+        """,
+        "columns": {
+            "username": "text",
+            "label": "category",
+            "has_data": "number",
+            "is_blue_verified": "number",
+            "account_created_at": "text",
+            "tweet_count": "number",
+            "favor_count": "number",
+            "follower_count": "number",
+            "following_count": "number",
+        },
+        "source_tables": ["users", "filtered_users"],
+    },
+}
+
+
+# === CHANGE TRACKING ===
+def tracking_triggers(table_name):
+    return [f"{VERSIONS_TABLE}_{table_name}_{event.lower()}" for event in TRACKED_EVENTS]
+
+def existing_triggers(db_connection):
+    rows = db_connection.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'", commit=False)
+    return {name for (name,) in rows}
+
+def track_table_changes(db_connection, table_name):
+    """
+    Creates triggers incrementing the version of "table_name" in the versions table whenever a row is inserted,
+    updated or deleted. The token identifies the tracking itself, so that versions of two different databases
+    (or of a table tracked again from scratch) are never confused: it is renewed whenever the triggers have to be
+    created (e.g. after the table was dropped and created again), since the changes made in the meantime were not
+    counted.
+    """
+    db_connection.execute(f"""
+    CREATE TABLE IF NOT EXISTS {VERSIONS_TABLE} (
+        table_name TEXT PRIMARY KEY,
+        token TEXT,
+        version INTEGER
+    )
+    """)
+    triggers = tracking_triggers(table_name)
+    if set(triggers) <= existing_triggers(db_connection):
+        return
+    db_connection.execute(f"INSERT OR REPLACE INTO {VERSIONS_TABLE} VALUES (?, ?, 0)",
+                          params=(table_name, uuid.uuid4().hex))
+    for trigger, event in zip(triggers, TRACKED_EVENTS):
+        db_connection.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {trigger} AFTER {event} ON {table_name}
+        BEGIN
+            UPDATE {VERSIONS_TABLE} SET version = version + 1 WHERE table_name = '{table_name}';
+        END
+        """)
+
+def track_analysis_tables(db_connection):
+    """
+    Tracks the changes of the source tables of ANALYSIS_TABLES that exist. Called where these tables are created
+    (see data_collection/filter_user_timelines.py).
+    """
+    for table_name in sorted({t for spec in ANALYSIS_TABLES.values() for t in spec["source_tables"]}):
+        if db_connection.column_names(table_name):
+            track_table_changes(db_connection, table_name)
+
+def get_table_versions(db_connection, table_names):
+    """
+    Returns {table_name: "token:version"}, or None if one of the tables is not tracked (no version, or one of its
+    triggers is missing).
+    """
+    try:
+        rows = db_connection.execute(f"SELECT table_name, token, version FROM {VERSIONS_TABLE}", commit=False)
+    except Exception:
+        return None
+    versions = {table_name: f"{token}:{version}" for table_name, token, version in rows}
+    if any(table_name not in versions for table_name in table_names):
+        return None
+    triggers = existing_triggers(db_connection)
+    if any(not set(tracking_triggers(table_name)) <= triggers for table_name in table_names):
+        return None
+    return {table_name: versions[table_name] for table_name in table_names}
+
+
+# === WRITING ===
+def write_column(folder, column, kind, values):
+    if kind == "category":
+        codes, categories = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+        np.save(os.path.join(folder, f"{column}.codes.npy"), codes.astype(np.int32))
+        with open(os.path.join(folder, f"{column}.categories.json"), "w", encoding="utf-8") as f:
+            json.dump(list(categories), f, ensure_ascii=False)
+
+    elif kind == "text":
+        valid = np.array([v is not None for v in values], dtype=bool)
+        strings = [v if v is not None else "" for v in values]
+        offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+        np.cumsum([len(s) for s in strings], out=offsets[1:])
+        np.save(os.path.join(folder, f"{column}.offsets.npy"), offsets)
+        np.save(os.path.join(folder, f"{column}.valid.npy"), valid)
+        with open(os.path.join(folder, f"{column}.txt"), "w", encoding="utf-8", newline="") as f:
+            f.write("".join(strings))
+
+    else:
+        array = pd.Series(values, dtype=object).infer_objects().to_numpy()
+        if array.dtype == object:
+            array = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=np.float64)
+        np.save(os.path.join(folder, f"{column}.npy"), array)
+
+def export_analysis_table(db_connection, name):
+    """
+    Runs the query of ANALYSIS_TABLES[name] and writes its result in a columnar format, with one folder
+    per label (partition). A "row_order" column keeps the position of each row in the query result.
+    """
+    spec = ANALYSIS_TABLES[name]
+    table_folder = os.path.join(db_connection.data_dir, CACHE_FOLDER, name)
+    tmp_folder = f"{table_folder}.tmp{os.getpid()}"
+    shutil.rmtree(tmp_folder, ignore_errors=True)
+
+    versions = get_table_versions(db_connection, spec["source_tables"])
+
+    cursor = db_connection.connection.cursor()
+    cursor.execute(spec["query"])
+    names = [description[0] for description in cursor.description]
+    rows = cursor.fetchall()
+    columns = dict(zip(names, zip(*rows))) if rows else {column: () for column in names}
+
+    labels = np.array(columns["label"], dtype=object)
+    partitions = [label for label in dict.fromkeys(columns["label"]) if label is not None]
+    for label in partitions:
+        folder = os.path.join(tmp_folder, f"label={label}")
+        os.makedirs(folder)
+        positions = np.flatnonzero(labels == label)
+        np.save(os.path.join(folder, "row_order.npy"), positions.astype(np.int64))
+        for column, kind in spec["columns"].items():
+            values = columns[column]
+            write_column(folder, column, kind, [values[i] for i in positions])
+
+    os.makedirs(tmp_folder, exist_ok=True)
+    with open(os.path.join(tmp_folder, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"versions": versions, "partitions": partitions, "columns": spec["columns"]}, f)
+
+    shutil.rmtree(table_folder, ignore_errors=True)
+    os.replace(tmp_folder, table_folder)
+
+
+# === READING ===
+def read_column(folder, column, kind):
+    if kind == "category":
+        codes = np.load(os.path.join(folder, f"{column}.codes.npy"), mmap_mode="r")
+        with open(os.path.join(folder, f"{column}.categories.json"), encoding="utf-8") as f:
+            categories = np.array(json.load(f) + [None], dtype=object)  # Code -1 (missing) maps to None
+        return categories[codes]
+
+    if kind == "text":
+        offsets = np.load(os.path.join(folder, f"{column}.offsets.npy"), mmap_mode="r")
+        valid = np.load(os.path.join(folder, f"{column}.valid.npy"), mmap_mode="r")
+        with open(os.path.join(folder, f"{column}.txt"), encoding="utf-8", newline="") as f:
+            text = f.read()
+        bounds = offsets.tolist()
+        values = np.array([text[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)], dtype=object)
+        values[~valid] = None
+        return values
+
+    # Numeric arrays are memory-mapped, not copied
+    return np.load(os.path.join(folder, f"{column}.npy"), mmap_mode="r")
+
+def load_analysis_table(db_connection, name, columns=None, labels=None):
+    """
+    Returns ANALYSIS_TABLES[name] as a DataFrame, read from the columnar export when it is up to date.
+
+    The export is (re)written automatically when one of its source tables changed since it was written.
+    When the source tables are not tracked (see track_table_changes), the query is run on the database directly.
+
+    Args:
+     -  columns (list): Columns to load (all by default).
+     -  labels (list): Partitions to load (all by default), e.g. ["fake"].
+    """
+    spec = ANALYSIS_TABLES[name]
+    columns = list(columns) if columns is not None else list(spec["columns"])
+
+    versions = get_table_versions(db_connection, spec["source_tables"])
+    if versions is None:
+        df = db_connection.select(spec["query"])
+        if labels is not None:
+            df = df[df["label"].isin(labels)].reset_index(drop=True)
+        return df[columns]
+
+    table_folder = os.path.join(db_connection.data_dir, CACHE_FOLDER, name)
+    manifest_path = os.path.join(table_folder, "manifest.json")
+    manifest = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    if manifest is None or manifest["versions"] != versions or manifest["columns"] != spec["columns"]:
+        export_analysis_table(db_connection, name)
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+
+    partitions = [label for label in manifest["partitions"] if labels is None or label in labels]
+    parts = []
+    orders = []
+    for label in partitions:
+        folder = os.path.join(table_folder, f"label={label}")
+        orders.append(np.load(os.path.join(folder, "row_order.npy"), mmap_mode="r"))
+        parts.append({column: read_column(folder, column, spec["columns"][column]) for column in columns})
+
+    if not parts:
+        return pd.DataFrame({column: [] for column in columns})
+
+    if len(parts) == 1:
+        data = parts[0]
+    else:
+        # Restore the order of the query result across partitions
+        order = np.argsort(np.concatenate(orders), kind="stable")
+        data = {column: np.concatenate([part[column] for part in parts])[order] for column in columns}
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+
+if __name__ == "__main__":
+    db_connection = DB_connection("GOSSIPCOP")
+    track_analysis_tables(db_connection)
+    for name in ANALYSIS_TABLES:
+        export_analysis_table(db_connection, name)
+        print(f"'{name}' exported")
+    db_connection.close()
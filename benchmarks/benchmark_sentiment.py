@@ -0,0 +1,214 @@
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from benchmarks.synthetic_tweets import generate_timelines, generate_tweets, SCALES
+
+BENCHMARK_FOLDER = os.path.dirname(os.path.abspath(__file__))
+SENTIMENT_FOLDER = os.path.join(os.path.dirname(BENCHMARK_FOLDER), "sentiment_analysis")
+BASELINE_PATH = os.path.join(BENCHMARK_FOLDER, "baseline.json")
+
+# A stage regresses when its throughput falls below 80% of the baseline, or its peak memory exceeds 125% of it
+THRESHOLDS = {"throughput": 0.8, "peak_memory_mb": 1.25}
+
+
+def measure(function, items, repeat=3, memory=True):
+    """
+    Runs function() (which processes "items" items) "repeat" times and returns the best wall time and throughput.
+    Peak memory is measured with tracemalloc in an additional run, since tracing slows the code down.
+    """
+    best = math.inf
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    result = {"items": items, "seconds": round(best, 4), "throughput": round(items / best, 1)}
+
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["peak_memory_mb"] = round(peak / 2 ** 20, 2)
+    return result
+
+
+def load_pipeline(tmp_folder):
+    """
+    Imports the preprocessing and scoring modules and loads their resources, with the lexicons of the
+    sentiment_analysis folder and the caches redirected to tmp_folder.
+    """
+    import sentiment_analysis.preprocess_tsa as preprocess_tsa
+    import sentiment_analysis.compute_sentiment_scores as compute_sentiment_scores
+
+    preprocess_tsa.LEXICAL_CACHE_PATH = os.path.join(tmp_folder, "lexical_cache.pkl")
+    preprocess_tsa.init_resources(download=False)
+    compute_sentiment_scores.init_resources(
+        senticnet_folder=SENTIMENT_FOLDER, polarity_lexicon_path=os.path.join(tmp_folder, "polarity_lexicon.pkl")
+    )
+    return preprocess_tsa, compute_sentiment_scores
+
+
+def run_benchmarks(scale, seed=0, repeat=3, memory=True, workers=None, stages=None):
+    from sentiment_analysis.ngram_store import NgramStore
+    from sentiment_analysis.polarity_lexicon import resolve_polarity
+
+    tweet_count = SCALES[scale]
+    tweets = generate_tweets(tweet_count, seed)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        P, C = load_pipeline(tmp_folder)
+        cache = P.lexical_cache
+
+        def preprocess():
+            return [P.preprocess_tweet_tokens(text) for text in tweets]
+
+        def preprocess_cold_cache():
+            cache.caches.clear()
+            cache.stored = {}
+            return preprocess()
+
+        def preprocess_uncached():
+            cache.enabled = False
+            try:
+                return preprocess()
+            finally:
+                cache.enabled = True
+
+        tokens_by_tweet = preprocess()  # Also warms up the lexical cache
+        tokens = [token for tweet_tokens in tokens_by_tweet for token in tweet_tokens]
+        token_count = len(tokens)
+
+        timelines = generate_timelines(tweet_count, seed)
+        df = pd.DataFrame(
+            [(username, tweet_id, text) for username, tweet_ids, texts in timelines
+             for tweet_id, text in zip(tweet_ids, texts)],
+            columns=["username", "tweet_id", "text_translation"],
+        )
+
+        def preprocess_parallel():
+            with NgramStore(os.path.join(tmp_folder, "store"), mode="w") as store:
+                P.preprocess_all_users(df, store, max_workers=workers or os.cpu_count())
+
+        def polarity_three_sources():
+            senticnet_polarities = C.senticnet_polarities
+            vader_lexicon = C.vader_analyzer.lexicon
+            for token in tokens:
+                resolve_polarity(token, senticnet_polarities, vader_lexicon)
+
+        C.polarity_lexicon.update(tokens)
+
+        def polarity_lexicon():
+            get = C.polarity_lexicon.get
+            for token in tokens:
+                get(token)
+
+        def scoring_ngrams():
+            for tweet_tokens in tokens_by_tweet:
+                C.score_tweet_from_ngrams(tweet_tokens)
+
+        def scoring_tokens():
+            for tweet_tokens in tokens_by_tweet:
+                C.score_tweet(tweet_tokens)
+
+        benchmarks = {
+            "preprocess_uncached": (preprocess_uncached, tweet_count),
+            "preprocess_cold_cache": (preprocess_cold_cache, tweet_count),
+            "preprocess_warm_cache": (preprocess, tweet_count),
+            "preprocess_parallel": (preprocess_parallel, tweet_count),
+            "polarity_three_sources": (polarity_three_sources, token_count),
+            "polarity_lexicon": (polarity_lexicon, token_count),
+            "scoring_ngrams": (scoring_ngrams, tweet_count),
+            "scoring_tokens": (scoring_tokens, tweet_count),
+        }
+        for name, (function, items) in benchmarks.items():
+            if stages and name not in stages:
+                continue
+            # The parallel stage runs in other processes: tracemalloc only sees the main process
+            results[name] = measure(function, items, repeat, memory and name != "preprocess_parallel")
+            print(f"{name}: {results[name]}")
+
+        cache.stored = {}
+        cache.caches.clear()
+
+    return {
+        "scale": scale,
+        "seed": seed,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "stages": results,
+    }
+
+
+def compare_with_baseline(report, baseline, thresholds=THRESHOLDS):
+    """
+    Returns the list of regressions of the report with respect to the baseline (same scale and seed only).
+    """
+    if (baseline["scale"], baseline["seed"]) != (report["scale"], report["seed"]):
+        print(f"The baseline was measured at scale '{baseline['scale']}' (seed {baseline['seed']}): not compared")
+        return []
+
+    regressions = []
+    for name, result in report["stages"].items():
+        reference = baseline["stages"].get(name)
+        if reference is None:
+            continue
+        if result["throughput"] < reference["throughput"] * thresholds["throughput"]:
+            regressions.append(f"{name}: {result['throughput']} items/s (baseline {reference['throughput']})")
+        if "peak_memory_mb" in result and "peak_memory_mb" in reference \
+                and result["peak_memory_mb"] > reference["peak_memory_mb"] * thresholds["peak_memory_mb"]:
+            regressions.append(f"{name}: {result['peak_memory_mb']} MB (baseline {reference['peak_memory_mb']})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the sentiment pipeline on synthetic tweets.")
+    parser.add_argument("--scale", choices=list(SCALES), default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=None, help="Processes of the parallel stage (all CPUs by default)")
+    parser.add_argument("--stages", nargs="*", default=None, help="Stages to run (all by default)")
+    parser.add_argument("--no-memory", action="store_true", help="Do not measure peak memory")
+    parser.add_argument("--output", default=None, help="JSON file where the results are written")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.scale, args.seed, args.repeat, not args.no_memory, args.workers, args.stages)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved in {BASELINE_PATH}")
+        return
+
+    if not os.path.exists(BASELINE_PATH):
+        print(f"No baseline to compare with in {BASELINE_PATH}: run once with --save-baseline to create it")
+        return
+    with open(BASELINE_PATH, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare_with_baseline(report, baseline)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import random
+
+# Number of tweets generated at each scale
+SCALES = {
+    "small": 1000,
+    "medium": 10000,
+    "large": 100000,
+}
+TWEETS_PER_USER = 100
+
+WORDS = [
+    "news", "story", "movie", "star", "actor", "singer", "show", "season", "fans", "photo", "wedding", "divorce",
+    "baby", "couple", "dress", "party", "award", "music", "album", "video", "interview", "rumor", "report",
+    "today", "tonight", "week", "year", "people", "family", "friend", "time", "life", "world", "day", "night",
+    "watch", "see", "read", "say", "think", "know", "want", "love", "hate", "like", "make", "take", "give",
+    "new", "big", "real", "fake", "true", "great", "good", "bad", "happy", "sad", "beautiful", "terrible",
+    "amazing", "awful", "funny", "crazy", "sweet", "cute", "angry", "proud", "sorry", "best", "worst",
+    "the", "a", "and", "but", "so", "very", "really", "just", "about", "with", "for", "this", "that", "is", "are",
+]
+
+# Phrases of several words, as found among the multiword keys of SenticNet
+PHRASES = [
+    "a lot", "look forward", "fall in love", "break up", "feel good", "give up", "at last", "get married",
+    "red carpet", "make fun of", "in love", "out of control", "best friend", "piece of cake", "heart broken",
+    "big deal", "let down", "cheer up", "good news", "bad news", "social media", "worth it",
+]
+
+ELONGATED = ["sooooo", "loooove", "yesss", "nooooo", "coooool", "haaappy", "wowwww", "omggg", "sooo gooood"]
+CONTRACTIONS = ["don't", "can't", "won't", "it's", "I'm", "they're", "isn't", "wasn't", "you've", "we'll"]
+NEGATIONS = ["not good", "not happy", "never true", "not real", "never fair", "not funny", "not bad"]
+EMOJIS = ["😂", "❤️", "😍", "😡", "😭", "👍", "🔥", "🙄", "💔", "✨"]
+HANDLES = ["@celebnews", "@popculture", "@tmz", "@people"]
+HASHTAGS = ["#gossip", "#breaking", "#celebs", "#hollywood", "#fakenews"]
+URLS = ["https://t.co/abc123", "http://bit.ly/xyz", "www.example.com/story"]
+
+# Relative weight of each kind of fragment in a tweet
+FRAGMENTS = [
+    (WORDS, 20),
+    (PHRASES, 3),
+    (ELONGATED, 1),
+    (CONTRACTIONS, 2),
+    (NEGATIONS, 1),
+    (EMOJIS, 2),
+    (HANDLES, 1),
+    (HASHTAGS, 1),
+    (URLS, 1),
+]
+
+
+def generate_tweet(rng, min_fragments=4, max_fragments=25):
+    lists = [fragments for fragments, _ in FRAGMENTS]
+    weights = [weight for _, weight in FRAGMENTS]
+    fragment_count = rng.randint(min_fragments, max_fragments)
+    return " ".join(rng.choice(fragments) for fragments in rng.choices(lists, weights, k=fragment_count))
+
+
+def generate_tweets(count, seed=0):
+    """
+    Returns "count" synthetic tweets, always the same for a given seed. They contain the cases handled by the
+    sentiment preprocessing: elongations, contractions, negations, emojis, multiword phrases, handles, hashtags
+    and URLs.
+    """
+    rng = random.Random(seed)
+    return [generate_tweet(rng) for _ in range(count)]
+
+
+def generate_timelines(count, seed=0, tweets_per_user=TWEETS_PER_USER):
+    """
+    Returns the same tweets as generate_tweets, grouped by synthetic user: [(username, tweet_ids, texts)].
+    """
+    tweets = generate_tweets(count, seed)
+    timelines = []
+    for start in range(0, count, tweets_per_user):
+        texts = tweets[start:start + tweets_per_user]
+        tweet_ids = [str(start + i) for i in range(len(texts))]
+        timelines.append((f"user{start // tweets_per_user:05d}", tweet_ids, texts))
+    return timelines
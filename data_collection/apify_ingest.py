@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import call
+import json
+
+FAILURES_TABLE = "ingest_failures"
+PAGE_SIZE = 250  # Number of dataset items fetched and written at once
+
+
+# Divide the items to be scraped into batches
+def chunked(lst, size):
+    for i in range(0, len(lst), size):
+        yield lst[i:i + size]
+
+
+def iter_dataset_pages(client, dataset_id, page_size=PAGE_SIZE):
+    """
+    Yields the items of an Apify dataset page by page, instead of loading the whole dataset at once.
+    """
+    dataset = client.dataset(dataset_id)
+    offset = 0
+    while True:
+        with call("apify.dataset"):
+            items = dataset.list_items(offset=offset, limit=page_size).items
+        if not items:
+            break
+        yield items
+        offset += len(items)
+        if len(items) < page_size:
+            break
+
+
+def create_failures_table(db_connection):
+    db_connection.execute(f"""
+    CREATE TABLE IF NOT EXISTS {FAILURES_TABLE} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        stage TEXT,
+        batch TEXT,
+        error TEXT,
+        created_at TEXT DEFAULT (datetime('now'))
+    )
+    """)
+
+
+def get_failed_batches(db_connection, stage):
+    """
+    Returns the batches of "stage" that failed in previous runs.
+
+    Returns:
+        - the ids of their rows in the failures table, to be passed to ingest_batches() with the batches: a row
+          is only deleted once its batch has been ingested successfully
+        - the batches
+    """
+    create_failures_table(db_connection)
+    rows = db_connection.execute(f"SELECT id, batch FROM {FAILURES_TABLE} WHERE stage = ? ORDER BY id",
+                                 params=(stage,), commit=False)
+    return [failure_id for failure_id, _ in rows], [json.loads(batch) for _, batch in rows]
+
+
+def ingest_batches(db_connection, client, actor_id, stage, batches, build_run_input, write_page,
+                   page_size=PAGE_SIZE, runs_ahead=1, failure_ids=None):
+    """
+    Runs an Apify actor once per batch and streams the items of each run into the database.
+
+    The actor runs are executed in a background thread, "runs_ahead" runs ahead of the writes: while the items
+    of a batch are being inserted, the run of the next batch is already in progress. Each page of items is
+    written and committed separately, so memory is bounded by the page size. Batches whose run or writes fail
+    are recorded in the failures table and can be retried with get_failed_batches().
+
+    Args:
+     -  stage (str): Name identifying the stage in the failures table.
+     -  batches (list): Batches of inputs (e.g. lists of tweet ids). They must be JSON-serializable.
+     -  build_run_input (callable): Function batch -> run_input of the actor.
+     -  write_page (callable): Function items -> number of rows written. It must not commit.
+     -  failure_ids (list): When retrying failed batches, the id of the failures table row of each batch. The
+        row is deleted once the batch has been ingested, or updated with the new error if it fails again.
+
+    Returns:
+        - the total number of rows written
+    """
+    create_failures_table(db_connection)
+
+    def run_actor(batch):
+        with call("apify.actor"):
+            return client.actor(actor_id).call(run_input=build_run_input(batch))
+
+    total_rows = 0
+    with ThreadPoolExecutor(max_workers=runs_ahead) as runner:
+        runs = [runner.submit(run_actor, batch) for batch in batches[:runs_ahead]]
+
+        for i, batch in enumerate(batches):
+            if i + runs_ahead < len(batches):
+                runs.append(runner.submit(run_actor, batches[i + runs_ahead]))
+
+            try:
+                run = runs[i].result()
+                runs[i] = None
+                batch_rows = 0
+
+                for items in iter_dataset_pages(client, run["defaultDatasetId"], page_size):
+                    batch_rows += write_page(items)
+                    db_connection.commit()
+
+                if failure_ids is not None:
+                    db_connection.execute(f"DELETE FROM {FAILURES_TABLE} WHERE id = ?", params=(failure_ids[i],))
+                if batch_rows == 0:
+                    print("No results for this batch")
+                total_rows += batch_rows
+
+            except Exception as e:
+                db_connection.connection.rollback()
+                print(f"Error for batch {i + 1}/{len(batches)} of {stage}: {e}")
+                if failure_ids is not None:
+                    db_connection.execute(f"UPDATE {FAILURES_TABLE} SET error = ?, created_at = datetime('now') WHERE id = ?",
+                                          params=(str(e), failure_ids[i]))
+                else:
+                    db_connection.execute(f"INSERT INTO {FAILURES_TABLE} (stage, batch, error) VALUES (?, ?, ?)",
+                                          params=(stage, json.dumps(batch), str(e)))
+
+    return total_rows
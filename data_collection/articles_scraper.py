@@ -2,11 +2,28 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath('../..'))
 
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from itertools import zip_longest
+import threading
+from urllib.parse import urlparse
+
 from tqdm import tqdm
 from newspaper import Article
-from sentence_transformers import SentenceTransformer, util
+from newspaper.article import ArticleDownloadState, ArticleException
+import numpy as np
+from sentence_transformers import SentenceTransformer
 
 from DB_connection import DB_connection
+from data_collection.embedding_cache import EmbeddingCache
+
+# === CONFIGURATION ===
+MAX_WORKERS = 16  # Number of concurrent downloads
+MAX_PER_HOST = 2  # Maximum number of concurrent downloads from the same host
+REQUEST_TIMEOUT = 10  # Seconds
+MAX_ATTEMPTS = 2  # Number of runs in which a failing url is retried
+COMMIT_EVERY = 100  # Number of articles per commit
+CHECKPOINT_TABLE = "news_fetch_checkpoint"
+SBERT_MODEL = "all-MiniLM-L6-v2"
 
 def format_url(url):
     if 'https://' in url or 'http://' in url:
@@ -14,56 +31,177 @@ def format_url(url):
     else:
         return 'https://' + url
 
-def get_article_text(url):
-    url = format_url(url)
-    article = Article(url)
+def download_article_html(url, timeout=REQUEST_TIMEOUT):
+    article = Article(url, request_timeout=timeout)
     article.download()
+    if article.download_state != ArticleDownloadState.SUCCESS:
+        raise ArticleException(article.download_exception_msg)
+    return article.html
+
+def parse_article_html(url, html):
+    article = Article(url)
+    article.download(input_html=html)
     article.parse()
     return article.text
 
-
-def add_news_text_in_db(db_connection):
-    news_df = db_connection.select('SELECT * FROM news')
-    urls = list(news_df["news_url"])
+def get_article_text(url, timeout=REQUEST_TIMEOUT):
+    url = format_url(url)
+    return parse_article_html(url, download_article_html(url, timeout))
+
+
+class HostLimiter:
+    """
+    Limits the number of concurrent requests sent to the same host.
+    """
+
+    def __init__(self, max_per_host):
+        self.max_per_host = max_per_host
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def semaphore(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.semaphores[host]
+
+
+def interleave_by_host(rows):
+    # Order the (rowid, url) pairs in a round-robin over hosts, so that consecutive downloads target different hosts
+    by_host = {}
+    for rowid, url in rows:
+        by_host.setdefault(urlparse(url).netloc, []).append((rowid, url))
+    return [row for group in zip_longest(*by_host.values()) for row in group if row is not None]
+
+
+def save_fetch_results(db_connection, texts, failures):
+    """
+    Writes the downloaded texts into the "news" table and records the failed attempts in the checkpoint table.
+    """
+    db_connection.update_many("news", ["news_text"], [(text, rowid) for rowid, text in texts], commit=False)
+    db_connection.executemany(f"""
+        INSERT INTO {CHECKPOINT_TABLE} (news_rowid, attempts, last_error) VALUES (?, 1, ?)
+        ON CONFLICT(news_rowid) DO UPDATE SET attempts = attempts + 1, last_error = excluded.last_error
+    """, failures, commit=False)
+    db_connection.commit()
+    texts.clear()
+    failures.clear()
+
+
+def add_news_text_in_db(db_connection, max_workers=MAX_WORKERS, max_per_host=MAX_PER_HOST, timeout=REQUEST_TIMEOUT,
+                        parse_workers=None):
+    """
+    Downloads the article of every row of the "news" table whose "news_text" is still missing and stores its text.
+    Texts are written incrementally, so an interrupted run can be resumed: only the rows without a text and which
+    have failed less than MAX_ATTEMPTS times are fetched again.
+
+    Args:
+     -  max_workers (int): Number of download threads.
+     -  max_per_host (int): Maximum number of concurrent downloads from the same host.
+     -  timeout (int): Timeout of each request in seconds.
+     -  parse_workers (int): If set, html pages are parsed in a pool of this many processes, separately from the
+        download threads. Otherwise, they are parsed by the download threads.
+    """
+    if "news_text" not in db_connection.column_names("news"):
+        db_connection.execute("ALTER TABLE news ADD COLUMN news_text TEXT")
+
+    db_connection.execute(f"""
+    CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+        news_rowid INTEGER PRIMARY KEY,
+        attempts INTEGER,
+        last_error TEXT
+    )
+    """)
+
+    rows = db_connection.execute(f"""
+        SELECT rowid, news_url FROM news
+        WHERE news_text IS NULL
+          AND rowid NOT IN (SELECT news_rowid FROM {CHECKPOINT_TABLE} WHERE attempts >= ?)
+    """, params=(MAX_ATTEMPTS,), commit=False)
+    rows = interleave_by_host([(rowid, format_url(url)) for rowid, url in rows if url])
+    pending = iter(rows)
+
+    limiter = HostLimiter(max_per_host)
+
+    def fetch(url):
+        with limiter.semaphore(url):
+            html = download_article_html(url, timeout)
+        return html if parse_workers else parse_article_html(url, html)
 
     texts = []
-    for url in tqdm(urls):
-        try:
-            text = get_article_text(url)
-            texts.append(text)
-        except:
-            texts.append(None)
-            continue
-    news_df["news_text"] = texts
-    db_connection.save_df(news_df, 'news')
-
-
-def compute_similarity_score_between_article_text_and_title(db_connection):
+    failures = []
+    in_flight = {}  # future -> (stage, rowid, url)
+    parse_pool = ProcessPoolExecutor(max_workers=parse_workers) if parse_workers else None
+    progress = tqdm(total=len(rows))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as download_pool:
+        def submit_downloads():
+            # Keep a bounded number of downloads in flight
+            downloads = sum(1 for stage, _, _ in in_flight.values() if stage == "download")
+            for rowid, url in pending:
+                in_flight[download_pool.submit(fetch, url)] = ("download", rowid, url)
+                downloads += 1
+                if downloads >= 2 * max_workers:
+                    break
+
+        submit_downloads()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, rowid, url = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failures.append((rowid, str(e)))
+                    progress.update()
+                    continue
+
+                if stage == "download" and parse_pool is not None:
+                    in_flight[parse_pool.submit(parse_article_html, url, result)] = ("parse", rowid, url)
+                else:
+                    texts.append((rowid, result))
+                    progress.update()
+
+            if len(texts) + len(failures) >= COMMIT_EVERY:
+                save_fetch_results(db_connection, texts, failures)
+            submit_downloads()
+
+        save_fetch_results(db_connection, texts, failures)
+
+    progress.close()
+    if parse_pool is not None:
+        parse_pool.shutdown()
+
+
+def compute_similarity_score_between_article_text_and_title(db_connection, batch_size=64, chunk_size=4096):
+    """
+    Computes the cosine similarity between the SBERT embeddings of the title and the text of every article
+    and stores it in the "title_and_text_similarity" column of the "news" table.
+    Embeddings are cached in the database (see EmbeddingCache), so a rerun only encodes new titles and texts.
+
+    Args:
+     -  batch_size (int): Batch size used by the sentence transformer.
+     -  chunk_size (int): Number of articles loaded and encoded at once.
+    """
     # Load the sentence transformer model
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-
-    # Fetch data from the database
-    news_df = db_connection.select('SELECT * FROM news')
-    titles = list(news_df["title"])
-    texts = list(news_df["news_text"])
-
-    similarity_score_column = []
-
-    for title, text in tqdm(zip(titles, texts)):
-        if text is None or len(text) == 0 or len(title) == 0 or title is None:
-            similarity_score = 0
-        else:
-            # Encode the title and text using SBERT embeddings
-            title_embedding = model.encode(title, convert_to_tensor=True)
-            text_embedding = model.encode(text, convert_to_tensor=True)
-
-            # Calculate cosine similarity
-            similarity_score = util.pytorch_cos_sim(title_embedding, text_embedding).item()
-        similarity_score_column.append(similarity_score)
-    news_df["title_and_text_similarity"] = similarity_score_column
-    db_connection.save_df(news_df,"news")
+    model = SentenceTransformer(SBERT_MODEL)
+    cache = EmbeddingCache(db_connection, SBERT_MODEL)
 
+    if "title_and_text_similarity" not in db_connection.column_names("news"):
+        db_connection.execute("ALTER TABLE news ADD COLUMN title_and_text_similarity REAL")
 
+    for rows in tqdm(db_connection.iter_chunks("news", ["title", "news_text"], chunk_size=chunk_size, as_frame=False)):
+        valid = [(rowid, title, text) for rowid, title, text in rows if title and text]
+        scores = {rowid: 0 for rowid, _, _ in rows}
 
+        if valid:
+            title_embeddings = cache.encode(model, [title for _, title, _ in valid], batch_size=batch_size)
+            text_embeddings = cache.encode(model, [text for _, _, text in valid], batch_size=batch_size)
 
+            # Embeddings are normalized: the cosine similarity is the row-wise dot product
+            similarities = np.einsum("ij,ij->i", title_embeddings, text_embeddings)
+            scores.update(zip((rowid for rowid, _, _ in valid), similarities.tolist()))
 
+        db_connection.update_many("news", ["title_and_text_similarity"],
+                                  [(score, rowid) for rowid, score in scores.items()])
@@ -0,0 +1,107 @@
+import hashlib
+import numpy as np
+
+EMBEDDING_TABLE = "embedding_cache"
+LOOKUP_CHUNK_SIZE = 500  # Stay below SQLite's limit on the number of query parameters
+
+
+def content_hash(text, model_name):
+    return hashlib.sha1(f"{model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def split_into_chunks(text, max_words):
+    # Split a text into consecutive windows of at most max_words words
+    words = text.split()
+    if not words:
+        return [text]
+    return [" ".join(words[i:i + max_words]) for i in range(0, len(words), max_words)]
+
+
+class EmbeddingCache:
+    """
+    Stores normalized sentence embeddings as compact binary blobs in the "embedding_cache" table,
+    keyed by a hash of the model name and the text.
+
+    Args:
+     -  db_connection (DB_connection): Database in which the embeddings are stored.
+     -  model_name (str): Name of the sentence-transformers model producing the embeddings.
+     -  dtype: Storage type of the vectors (np.float32 or np.float16). Vectors are always returned as float32.
+    """
+
+    def __init__(self, db_connection, model_name, dtype=np.float32):
+        self.db_connection = db_connection
+        self.model_name = model_name
+        self.dtype = np.dtype(dtype)
+
+        self.db_connection.execute(f"""
+        CREATE TABLE IF NOT EXISTS {EMBEDDING_TABLE} (
+            content_hash TEXT PRIMARY KEY,
+            model TEXT,
+            dtype TEXT,
+            vector BLOB
+        )
+        """)
+
+    def get_many(self, hashes):
+        vectors = {}
+        for i in range(0, len(hashes), LOOKUP_CHUNK_SIZE):
+            chunk = hashes[i:i + LOOKUP_CHUNK_SIZE]
+            placeholders = ", ".join("?" for _ in chunk)
+            rows = self.db_connection.execute(
+                f"SELECT content_hash, dtype, vector FROM {EMBEDDING_TABLE} WHERE content_hash IN ({placeholders})",
+                params=chunk, commit=False
+            )
+            for h, dtype, blob in rows:
+                vectors[h] = np.frombuffer(blob, dtype=dtype).astype(np.float32)
+        return vectors
+
+    def put_many(self, items):
+        self.db_connection.insert_many(
+            EMBEDDING_TABLE,
+            ["content_hash", "model", "dtype", "vector"],
+            [(h, self.model_name, self.dtype.str, vector.astype(self.dtype).tobytes()) for h, vector in items],
+            on_conflict="REPLACE"
+        )
+
+    def encode(self, model, texts, batch_size=64, max_words=128):
+        """
+        Returns a (len(texts), dim) float32 array with the normalized embedding of each text.
+
+        Only the texts absent from the cache are encoded. Texts longer than max_words words are split into chunks
+        (instead of being truncated by the model): their embedding is the normalized mean of the embeddings
+        of their chunks. All chunks are encoded together, sorted by length, so that batches contain texts of
+        similar size and padding is minimal.
+        """
+        hashes = [content_hash(text, self.model_name) for text in texts]
+        vectors = self.get_many(list(set(hashes)))
+
+        missing = {h: text for h, text in zip(hashes, texts) if h not in vectors}
+        if missing:
+            chunk_texts = []
+            chunk_owners = []
+            for h, text in missing.items():
+                for chunk in split_into_chunks(text, max_words):
+                    chunk_texts.append(chunk)
+                    chunk_owners.append(h)
+
+            order = sorted(range(len(chunk_texts)), key=lambda i: len(chunk_texts[i]))
+            chunk_embeddings = model.encode(
+                [chunk_texts[i] for i in order], batch_size=batch_size,
+                convert_to_numpy=True, normalize_embeddings=True
+            )
+
+            # Mean of the chunk embeddings of each text
+            owner_ids = {h: i for i, h in enumerate(missing)}
+            owner_index = np.array([owner_ids[chunk_owners[i]] for i in order])
+            sums = np.zeros((len(missing), chunk_embeddings.shape[1]), dtype=np.float32)
+            np.add.at(sums, owner_index, chunk_embeddings)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            sums /= np.where(norms == 0, 1, norms)
+
+            # Round-trip through the storage type so that fresh and cached vectors are identical
+            sums = sums.astype(self.dtype).astype(np.float32)
+            new_vectors = list(zip(missing, sums))
+            self.put_many(new_vectors)
+            vectors.update(new_vectors)
+
+        return np.stack([vectors[h] for h in hashes]) if hashes else np.zeros((0, 0), dtype=np.float32)
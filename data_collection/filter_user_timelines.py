@@ -1,65 +1,179 @@
+from analysis_cache import track_analysis_tables
 from DB_connection import DB_connection
-import pandas as pd
+
+from data_collection.json_features import add_json_feature_columns
+
+MIN_TWEETS = 100  # Minimum number of valid tweets per user
+DATA_TABLE = "filtered_user_timelines_data"
+USERS_TABLE = "filtered_users"
+DIRTY_TABLE = "filtered_user_timelines_dirty"
+
+# Conditions that a tweet of user_timelines must meet to be kept
+VALID_TWEET_CONDITION = """
+    t.tweet_id IS NOT NULL
+    AND t.text IS NOT NULL AND TRIM(t.text) != ''
+    AND (
+        (t.text_translation IS NOT NULL AND TRIM(t.text_translation) != '')
+        OR
+        (t.quoted_translation IS NOT NULL AND TRIM(t.quoted_translation) != '')
+    )
+    AND t.label IN ('fake', 'real')
+"""
+
+
+def create_filtered_tables(db_connection):
+    """
+    Creates the objects behind "filtered_user_timelines":
+     -  DATA_TABLE: the valid tweets of the selected users (materialized), with every column of user_timelines
+        (generated columns included), keyed by (username, tweet_id). "tweet_index" is the position of each tweet
+        in the timeline of its user, by tweet_id,
+     -  USERS_TABLE: the selected users and their order (fake and real users alternate),
+     -  DIRTY_TABLE: the users whose timeline changed since the last refresh, filled by triggers on user_timelines,
+     -  the "filtered_user_timelines" view, which returns the columns of user_timelines, user by user in that order.
+
+    Returns:
+        - True if the objects did not exist yet, or if the columns of user_timelines changed (a full build is needed)
+    """
+    columns = db_connection.column_names("user_timelines")
+    first_build = db_connection.column_names(DATA_TABLE) != ["tweet_index"] + columns
+
+    # filtered_user_timelines used to be a table rebuilt from scratch by pandas
+    rows = db_connection.execute("SELECT type FROM sqlite_master WHERE name = 'filtered_user_timelines'", commit=False)
+    if rows and rows[0][0] == "table":
+        db_connection.execute("DROP TABLE filtered_user_timelines")
+
+    if first_build:
+        # The view and the update trigger list the columns of user_timelines: they are created again as well
+        db_connection.execute("DROP VIEW IF EXISTS filtered_user_timelines")
+        db_connection.execute(f"DROP TRIGGER IF EXISTS {DIRTY_TABLE}_update")
+        db_connection.execute(f"DROP TABLE IF EXISTS {DATA_TABLE}")
+
+    db_connection.execute(f"""
+    CREATE TABLE IF NOT EXISTS {DATA_TABLE} (
+        tweet_index INTEGER,
+        {', '.join(columns)},
+        PRIMARY KEY (username, tweet_id)
+    )
+    """)
+    db_connection.execute(f"CREATE INDEX IF NOT EXISTS idx_{DATA_TABLE}_order ON {DATA_TABLE} (username, tweet_index)")
+
+    db_connection.execute(f"""
+    CREATE TABLE IF NOT EXISTS {USERS_TABLE} (
+        username TEXT PRIMARY KEY,
+        label TEXT,
+        user_order INTEGER
+    )
+    """)
+    db_connection.execute(f"CREATE INDEX IF NOT EXISTS idx_{USERS_TABLE}_order ON {USERS_TABLE} (user_order)")
+
+    db_connection.execute(f"CREATE TABLE IF NOT EXISTS {DIRTY_TABLE} (username TEXT PRIMARY KEY)")
+    db_connection.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS {DIRTY_TABLE}_insert AFTER INSERT ON user_timelines
+    BEGIN
+        INSERT OR IGNORE INTO {DIRTY_TABLE} VALUES (NEW.username);
+    END
+    """)
+    db_connection.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS {DIRTY_TABLE}_update AFTER UPDATE ON user_timelines
+    BEGIN
+        INSERT OR IGNORE INTO {DIRTY_TABLE} VALUES (OLD.username);
+        INSERT OR IGNORE INTO {DIRTY_TABLE} VALUES (NEW.username);
+    END
+    """)
+    db_connection.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS {DIRTY_TABLE}_delete AFTER DELETE ON user_timelines
+    BEGIN
+        INSERT OR IGNORE INTO {DIRTY_TABLE} VALUES (OLD.username);
+    END
+    """)
+
+    db_connection.execute(f"""
+    CREATE VIEW IF NOT EXISTS filtered_user_timelines AS
+    SELECT {', '.join('d.' + column for column in columns)}
+    FROM {USERS_TABLE} u
+    CROSS JOIN {DATA_TABLE} d ON d.username = u.username  -- CROSS JOIN: read users in order, then their tweets by index
+    ORDER BY u.user_order, d.tweet_index
+    """)
+
+    # Versions of the tables exported for the analysis scripts (see analysis_cache.py)
+    track_analysis_tables(db_connection)
+
+    return first_build
+
 
 # === FILTER FUNCTION ===
-def create_filtered_user_timelines(db_connection):
-    query = """
-        SELECT * FROM user_timelines
-        WHERE tweet_id IS NOT NULL
-          AND text IS NOT NULL AND TRIM(text) != ''
-          AND (
-              (text_translation IS NOT NULL AND TRIM(text_translation) != '')
-              OR
-              (quoted_translation IS NOT NULL AND TRIM(quoted_translation) != '')
-          )
-          AND username IN (
-              SELECT username
-              FROM user_timelines
-              WHERE tweet_id IS NOT NULL
-                AND text IS NOT NULL AND TRIM(text) != ''
-                AND (
-                    (text_translation IS NOT NULL AND TRIM(text_translation) != '')
-                    OR
-                    (quoted_translation IS NOT NULL AND TRIM(quoted_translation) != '')
-                )
-              GROUP BY username
-              HAVING COUNT(*) >= 100
-          )
+def refresh_filtered_user_timelines(db_connection, full_rebuild=False):
     """
-    df = db_connection.select(query)
-
-    fake_users = df[df['label'] == 'fake'].groupby('username')
-    real_users = df[df['label'] == 'real'].groupby('username')
-
-    result_rows = []
-    fake_iter = iter(fake_users)
-    real_iter = iter(real_users)
-
-    while True:
-        added = False
-        if fake_iter is not None:
-            try:
-                _, fake_df = next(fake_iter)
-                result_rows.append(fake_df)
-                added = True
-            except StopIteration:
-                fake_iter = None
-
-        if real_iter is not None:
-            try:
-                _, real_df = next(real_iter)
-                result_rows.append(real_df)
-                added = True
-            except StopIteration:
-                real_iter = None
-
-        if not added:
-            break
-
-    final_df = pd.concat(result_rows, ignore_index=True)
-    db_connection.save_df(final_df, "filtered_user_timelines")
+    Keeps, for every user with at least MIN_TWEETS valid tweets, the valid tweets of their timeline.
+    Only the users whose timeline changed since the last refresh are recomputed, unless full_rebuild is True.
+
+    Returns:
+        - the number of users recomputed
+    """
+    add_json_feature_columns(db_connection)
+    columns = db_connection.column_names("user_timelines")
+    if create_filtered_tables(db_connection) or full_rebuild:
+        db_connection.execute(f"INSERT OR IGNORE INTO {DIRTY_TABLE} SELECT DISTINCT username FROM user_timelines")
+        db_connection.execute(f"INSERT OR IGNORE INTO {DIRTY_TABLE} SELECT username FROM {USERS_TABLE}")
+
+    dirty_count = db_connection.select_single_value(f"SELECT COUNT(*) FROM {DIRTY_TABLE}")
+    if dirty_count == 0:
+        return 0
+
+    dirty_users = f"SELECT username FROM {DIRTY_TABLE}"
+    statements = [
+        f"DELETE FROM {DATA_TABLE} WHERE username IN ({dirty_users})",
+        f"DELETE FROM {USERS_TABLE} WHERE username IN ({dirty_users})",
+
+        # Window functions: number of valid tweets of each user, computed in the same pass as the selection, and
+        # position of each tweet in the timeline of its user, by tweet_id (as read through the primary key index of
+        # user_timelines, unlike rowids, which VACUUM can renumber)
+        f"""
+        INSERT INTO {DATA_TABLE} (tweet_index, {', '.join(columns)})
+        SELECT tweet_index, {', '.join(columns)}
+        FROM (
+            SELECT ROW_NUMBER() OVER (PARTITION BY t.username ORDER BY t.tweet_id) AS tweet_index,
+                   {', '.join('t.' + column for column in columns)},
+                   COUNT(*) OVER (PARTITION BY t.username) AS valid_tweets
+            FROM user_timelines t
+            WHERE t.username IN ({dirty_users}) AND {VALID_TWEET_CONDITION}
+        )
+        WHERE valid_tweets >= {MIN_TWEETS}
+        """,
+
+        f"""
+        INSERT INTO {USERS_TABLE} (username, label)
+        SELECT DISTINCT username, label FROM {DATA_TABLE} WHERE username IN ({dirty_users})
+        """,
+
+        # Alternate fake and real users (in alphabetical order within each label)
+        f"""
+        UPDATE {USERS_TABLE} SET user_order = ranked.user_order
+        FROM (
+            SELECT username, ROW_NUMBER() OVER (ORDER BY label_rank, label) AS user_order
+            FROM (
+                SELECT username, label, ROW_NUMBER() OVER (PARTITION BY label ORDER BY username) AS label_rank
+                FROM {USERS_TABLE}
+            )
+        ) AS ranked
+        WHERE {USERS_TABLE}.username = ranked.username
+        """,
+
+        f"DELETE FROM {DIRTY_TABLE}",
+    ]
+
+    try:
+        for statement in statements:
+            db_connection.execute(statement, commit=False)
+        db_connection.commit()
+    except Exception:
+        db_connection.connection.rollback()
+        raise
+
+    return dirty_count
 
 if __name__ == "__main__":
     db_connection = DB_connection("GOSSIPCOP")
-    create_filtered_user_timelines(db_connection)
+    refreshed_users = refresh_filtered_user_timelines(db_connection)
+    print(f"{refreshed_users} users refreshed in filtered_user_timelines")
     db_connection.close()
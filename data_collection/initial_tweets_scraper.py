@@ -1,16 +1,16 @@
 from apify_client import ApifyClient
+from DB_connection import DB_connection
 from dotenv import load_dotenv
+import instrumentation
 import json
 import os
-import sqlite3
-import time
 
-# Divide tweets to be scraped into batches
-def chunked(lst, size):
-    for i in range(0, len(lst), size):
-        yield lst[i:i + size]
+from data_collection.apify_ingest import chunked, get_failed_batches, ingest_batches
 
-def scrape_initial_tweets(label_type):
+ACTOR_ID = "coder_luffy/free-tweet-scraper"
+BATCH_SIZE = 1000  # Number of tweet ids per actor run
+
+def scrape_initial_tweets(label_type, client=None, retry_failed=False):
     """
     Scrapes initial tweets from a list of tweet ids stored in a database table using an Apify actor.
     The initial tweets collected are in turn saved in another database table.
@@ -18,24 +18,26 @@ def scrape_initial_tweets(label_type):
     Args:
      -  label_type (str): Either "fake" or "real" (relating to the type of news you want to process),
         used to select source and destination tables.
+     -  client: ApifyClient, or any object with the same interface (created from APIFY_TOKEN by default).
+     -  retry_failed (bool): Only scrape the batches that failed in previous runs.
     """
 
     if label_type not in ["fake", "real"]:
         print("label_type must be 'fake' or 'real'")
         return
 
-    load_dotenv()
-    APIFY_TOKEN = os.getenv("APIFY_TOKEN")  # Retrieve the API key to use the scraper
-    client = ApifyClient(APIFY_TOKEN)
+    if client is None:
+        load_dotenv()
+        APIFY_TOKEN = os.getenv("APIFY_TOKEN")  # Retrieve the API key to use the scraper
+        client = ApifyClient(APIFY_TOKEN)
 
-    db_path = "../data/GossipCop/database.db"
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    db_connection = DB_connection("GOSSIPCOP")
 
     destination_table = f"collected_tweets_{label_type}"
     source_table = f"selected_tweet_ids_{label_type}"
+    stage = f"initial_tweets_{label_type}"
 
-    cursor.execute(f"""
+    db_connection.execute(f"""
     CREATE TABLE IF NOT EXISTS {destination_table} (
         tweet_id TEXT PRIMARY KEY,
         username TEXT,
@@ -44,47 +46,38 @@ def scrape_initial_tweets(label_type):
     )
     """)
 
-    # Retrieve tweet ids to scrape
-    cursor.execute(f"SELECT tweet_id FROM {source_table}")
-    rows = cursor.fetchall()
-    tweet_ids = [row[0] for row in rows]
-
-    for batch in chunked(tweet_ids, 1000):
-        try:
-            run_input = {"tweetIds": batch}
-            run = client.actor("coder_luffy/free-tweet-scraper").call(run_input=run_input)
-            items = client.dataset(run["defaultDatasetId"]).list_items().items
-
-            if not items:
-                print("No results for this batch")
+    failure_ids = None
+    if retry_failed:
+        failure_ids, batches = get_failed_batches(db_connection, stage)
+    else:
+        # Retrieve tweet ids to scrape
+        rows = db_connection.execute(f"SELECT tweet_id FROM {source_table}", commit=False)
+        tweet_ids = [row[0] for row in rows]
+        batches = list(chunked(tweet_ids, BATCH_SIZE))
+
+    def write_page(items):
+        rows = []
+        for tweet in items:
+            if tweet.get("tombstone", False):
+                continue
+            if tweet.get("error", False):
                 continue
 
-            for tweet in items:
-                tweet_id = tweet.get('tweet_id')
-
-                if tweet.get("tombstone", False):
-                    continue
-                if tweet.get("error", False):
-                    continue
-
-                username = tweet['user']['screen_name']
-                text = tweet['text'].replace("\u00A0", " ").strip()  # Clean tweet text
-                full_data = json.dumps(tweet)
-
-                cursor.execute(f"""
-                INSERT OR IGNORE INTO {destination_table} (tweet_id, username, text, full_data)
-                VALUES (?, ?, ?, ?)
-                """, (tweet_id, username, text, full_data))
+            tweet_id = tweet.get('tweet_id')
+            username = tweet['user']['screen_name']
+            text = tweet['text'].replace("\u00A0", " ").strip()  # Clean tweet text
+            full_data = json.dumps(tweet)
+            rows.append((tweet_id, username, text, full_data))
 
-            start_push = time.time()
-            conn.commit()
-            end_push = time.time()
-            print(f"[Push_time={end_push - start_push:.2f}s]")  # Indicate when a batch of tweets has been added to the database
+        db_connection.insert_many(destination_table, ["tweet_id", "username", "text", "full_data"], rows, commit=False)
+        return len(rows)
 
-        except Exception as e:
-            print(f"Error for batch {batch}: {e}")
+    with instrumentation.stage(f"apify.{stage}", batches=len(batches)) as record:
+        record.rows = ingest_batches(db_connection, client, ACTOR_ID, stage, batches,
+                                     build_run_input=lambda batch: {"tweetIds": batch}, write_page=write_page,
+                                     failure_ids=failure_ids)
 
-    conn.close()
+    db_connection.close()
 
 
 # Use of the function
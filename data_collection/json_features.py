@@ -0,0 +1,53 @@
+from DB_connection import DB_connection
+
+# Fields of the "full_data" JSON blobs exposed as generated columns: {table: {column: JSON path}}
+JSON_FEATURES = {
+    "users": {
+        "tweet_count": "$.tweet_counts.tweets",
+        "favor_count": "$.action_counts.favorites_count",
+        "follower_count": "$.relationship_counts.followers",
+        "following_count": "$.relationship_counts.following",
+        "is_blue_verified": "$.verification.is_blue_verified",
+        "account_created_at": "$.core.created_at",
+    },
+    "user_timelines": {
+        "tweet_created_at": "$.created_at",
+        "replies": "$.replies",
+        "retweets": "$.retweets",
+    },
+}
+
+# Indexes on the generated columns. The values of virtual columns are stored in their indexes, so queries
+# covered by an index never parse the JSON blobs.
+JSON_FEATURE_INDEXES = {
+    "idx_users_tweet_count": ("users", ["tweet_count"]),
+    "idx_user_timelines_features": ("user_timelines", ["username", "tweet_id", "tweet_created_at", "replies", "retweets"]),
+}
+
+def add_json_feature_columns(db_connection):
+    """
+    Adds the fields listed in JSON_FEATURES as virtual generated columns (json_extract over "full_data")
+    to the "users" and "user_timelines" tables, and creates their indexes. Malformed JSON gives NULL values.
+    Columns and indexes that already exist are left untouched, as well as the tables that do not exist yet.
+    """
+    for table_name, features in JSON_FEATURES.items():
+        existing_columns = db_connection.column_names(table_name)
+        if not existing_columns:
+            continue  # The table has not been created yet
+        for column, path in features.items():
+            if column in existing_columns:
+                continue
+            db_connection.execute(f"""
+                ALTER TABLE {table_name} ADD COLUMN {column}
+                GENERATED ALWAYS AS (CASE WHEN json_valid(full_data) THEN json_extract(full_data, '{path}') END) VIRTUAL
+            """)
+
+    for index_name, (table_name, columns) in JSON_FEATURE_INDEXES.items():
+        if not db_connection.column_names(table_name):
+            continue
+        db_connection.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({', '.join(columns)})")
+
+if __name__ == "__main__":
+    db_connection = DB_connection("GOSSIPCOP")
+    add_json_feature_columns(db_connection)
+    db_connection.close()
@@ -0,0 +1,78 @@
+from itertools import count
+import threading
+import time
+from types import SimpleNamespace
+
+
+def synthetic_timeline(actor_id, run_input):
+    """
+    Default item factory: returns "max_posts" synthetic tweets for the requested username.
+    """
+    username = run_input.get("username", "user")
+    return [
+        {"tweet_id": f"{username}-{i}", "text": f"Synthetic tweet {i} from {username}"}
+        for i in range(run_input.get("max_posts", 100))
+    ]
+
+
+class LocalApifyClient:
+    """
+    Offline stand-in for ApifyClient, used to measure the throughput of the scrapers without calling Apify.
+    It supports the subset of the client API used in this repository: actor(...).call(run_input=...)
+    and dataset(...).list_items(offset=..., limit=...) / iterate_items().
+
+    Args:
+     -  item_factory (callable): Function (actor_id, run_input) -> list of items stored in the run's dataset.
+     -  latency (float): Duration of an actor run in seconds.
+     -  failure_rate (float): Fraction of actor runs raising an exception (every round(1 / failure_rate)-th run).
+    """
+
+    def __init__(self, item_factory=synthetic_timeline, latency=1.0, failure_rate=0.0):
+        self.item_factory = item_factory
+        self.latency = latency
+        self.failure_period = round(1 / failure_rate) if failure_rate else None
+        self.datasets = {}
+        self.runs = count(1)
+        self.lock = threading.Lock()
+
+    def actor(self, actor_id):
+        return LocalActor(self, actor_id)
+
+    def dataset(self, dataset_id):
+        with self.lock:
+            return LocalDataset(self.datasets[dataset_id])
+
+
+class LocalActor:
+
+    def __init__(self, client, actor_id):
+        self.client = client
+        self.actor_id = actor_id
+
+    def call(self, run_input=None):
+        client = self.client
+        time.sleep(client.latency)
+        with client.lock:
+            run_number = next(client.runs)
+        if client.failure_period and run_number % client.failure_period == 0:
+            raise RuntimeError(f"Simulated failure of run {run_number}")
+
+        dataset_id = f"dataset-{run_number}"
+        items = client.item_factory(self.actor_id, run_input or {})
+        with client.lock:
+            client.datasets[dataset_id] = items
+        return {"id": f"run-{run_number}", "status": "SUCCEEDED", "defaultDatasetId": dataset_id}
+
+
+class LocalDataset:
+
+    def __init__(self, items):
+        self.items = items
+
+    def list_items(self, offset=0, limit=None):
+        end = len(self.items) if limit is None else offset + limit
+        page = self.items[offset:end]
+        return SimpleNamespace(items=page, offset=offset, limit=limit, count=len(page), total=len(self.items))
+
+    def iterate_items(self):
+        yield from self.items
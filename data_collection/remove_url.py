@@ -11,34 +11,17 @@ def clean_text(value):
     return cleaned if cleaned else None
 
 def clean_user_timelines(db_connection, batch_size=1000):
-    offset = 0
     rows_processed = 0
+    columns = ["text_translation", "quoted_translation"]
 
-    while True:
-        query = f"""
-            SELECT rowid, text_translation, quoted_translation
-            FROM user_timelines
-            LIMIT {batch_size} OFFSET {offset}
-        """
-        rows = db_connection.select(query)
+    for rows in db_connection.iter_chunks("user_timelines", columns, chunk_size=batch_size, as_frame=False):
+        cleaned_rows = [
+            (clean_text(text_translation), clean_text(quoted_translation), rowid)
+            for rowid, text_translation, quoted_translation in rows
+        ]
+        db_connection.update_many("user_timelines", columns, cleaned_rows)
 
-        if rows.empty:
-            break
-
-        for index, row in rows.iterrows():
-            rowid = row["rowid"]
-            new_text = clean_text(row["text_translation"])
-            new_quoted = clean_text(row["quoted_translation"])
-
-            db_connection.connection.execute("""
-                UPDATE user_timelines
-                SET text_translation = ?, quoted_translation = ?
-                WHERE rowid = ?
-            """, (new_text, new_quoted, rowid))
-
-        db_connection.connection.commit()
         rows_processed += len(rows)
-        offset += batch_size
         print(f"Processed {rows_processed} rows...")
 
 if __name__ == "__main__":
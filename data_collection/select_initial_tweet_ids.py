@@ -47,11 +47,16 @@ def select_initial_tweet_ids(label_type):
     )
     """)
 
-    for tweet_id in tweet_ids:
-        try:
-            cursor.execute(f"INSERT OR IGNORE INTO {destination_table} (tweet_id) VALUES (?)", (tweet_id,))
-        except Exception as e:
-            print(f"Error when inserting ID {tweet_id}: {e}")
+    insert_query = f"INSERT OR IGNORE INTO {destination_table} (tweet_id) VALUES (?)"
+    try:
+        cursor.executemany(insert_query, ((tweet_id,) for tweet_id in tweet_ids))
+    except Exception:
+        # Insert the IDs one by one to report those that fail (the IDs already inserted are ignored)
+        for tweet_id in tweet_ids:
+            try:
+                cursor.execute(insert_query, (tweet_id,))
+            except Exception as e:
+                print(f"Error when inserting ID {tweet_id}: {e}")
 
     conn.commit()
     conn.close()
@@ -1,47 +1,35 @@
-from deep_translator import GoogleTranslator
 from DB_connection import DB_connection
+from data_collection.translation_engine import TranslationEngine
 
 # === CONFIGURATION ===
-BATCH_SIZE = 100  # Number of users per commit
-
-# === TRANSLATION FUNCTION ===
-def preprocess_bio(text):
-    if not text:
-        return None
-    try:
-        translated = GoogleTranslator(source='auto', target='en').translate(text)
-        return translated
-    except Exception as e:
-        print(f"Translation failed for: {text}\nError: {e}")
-        return None
+BATCH_SIZE = 1000  # Number of users per commit
+MAX_WORKERS = 8  # Number of concurrent translation requests
+REQUESTS_PER_SECOND = 5.0  # Rate limit of the translation service
 
 # === MAIN FUNCTION ===
-def translate_user_bios(db_connection):
-    columns_df = db_connection.select("PRAGMA table_info(users);")
-    columns = columns_df["username"].tolist()
+def translate_user_bios(db_connection, backend=None):
+    """
+    Translates the bio of every user of the 'users' table into English.
+    Bios that are already translated are skipped, so the function can be resumed after an interruption.
+
+    Args:
+     -  backend: Translation backend used by the TranslationEngine (Google Translate by default).
+    """
+    columns = db_connection.column_names("users")
 
     if "bio_translation" not in columns:
         db_connection.connection.execute("ALTER TABLE users ADD COLUMN bio_translation TEXT;")
         db_connection.connection.commit()
 
-    users_df = db_connection.select("SELECT username, bio FROM users;")
-
-    for i, row in users_df.iterrows():
-        username = row["username"]
-        bio = row["bio"]
-
-        translation = preprocess_bio(bio)
-
-        db_connection.connection.execute("""
-            UPDATE users
-            SET bio_translation = ?
-            WHERE username = ?;
-        """, (translation, username))
-
-        if (i + 1) % BATCH_SIZE == 0:
-            db_connection.connection.commit()
+    engine = TranslationEngine(db_connection, backend=backend, max_workers=MAX_WORKERS,
+                               requests_per_second=REQUESTS_PER_SECOND)
 
-    db_connection.connection.commit()
+    for rows in db_connection.iter_chunks(
+            "users", ["bio"], chunk_size=BATCH_SIZE,
+            where="bio_translation IS NULL AND TRIM(COALESCE(bio, '')) != ''", as_frame=False):
+        translations = engine.translate([bio for _, bio in rows])
+        translated_rows = [(translations.get(bio), rowid) for rowid, bio in rows]
+        db_connection.update_many("users", ["bio_translation"], translated_rows)
 
 if __name__ == "__main__":
     db_connection = DB_connection("GOSSIPCOP")
@@ -0,0 +1,200 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from deep_translator import GoogleTranslator
+import hashlib
+from instrumentation import call
+import random
+import threading
+import time
+
+CACHE_TABLE = "translation_cache"
+LOOKUP_CHUNK_SIZE = 500  # Stay below SQLite's limit on the number of query parameters
+
+
+def chunked(lst, size):
+    for i in range(0, len(lst), size):
+        yield lst[i:i + size]
+
+
+def text_hash(text, namespace):
+    return hashlib.sha1(f"{namespace}\x00{text}".encode("utf-8")).hexdigest()
+
+
+# === BACKENDS ===
+class GoogleBackend:
+    """
+    Translation through deep_translator's GoogleTranslator. A single translator object is kept per worker thread.
+    """
+
+    def __init__(self, source="auto", target="en"):
+        self.source = source
+        self.target = target
+        self.name = f"google:{source}>{target}"
+        self._local = threading.local()
+
+    def _translator(self):
+        translator = getattr(self._local, "translator", None)
+        if translator is None:
+            translator = GoogleTranslator(source=self.source, target=self.target)
+            self._local.translator = translator
+        return translator
+
+    def translate_batch(self, texts):
+        translator = self._translator()
+        return [translator.translate(text) for text in texts]
+
+
+class LocalBackend:
+    """
+    Offline stand-in for benchmarking: returns the texts unchanged after sleeping "latency" seconds per text,
+    which mimics the latency of one request to the translation service.
+    """
+
+    def __init__(self, latency=0.2, name="local"):
+        self.latency = latency
+        self.name = name
+
+    def translate_batch(self, texts):
+        time.sleep(self.latency * len(texts))
+        return list(texts)
+
+
+# === RATE LIMITING ===
+class RateLimiter:
+    """
+    Thread-safe token bucket allowing on average "rate" requests per second (bursts of at most "burst" requests).
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, n=1):
+        """
+        Waits until "n" tokens have been taken. More tokens than the capacity of the bucket are taken in several
+        steps, so a batch of n requests always pays for all of them.
+        """
+        while n > 0:
+            step = min(n, self.capacity)
+            self._acquire_step(step)
+            n -= step
+
+    def _acquire_step(self, n):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                wait = (n - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# === ENGINE ===
+class TranslationEngine:
+    """
+    Translates texts with a pool of worker threads, each distinct text being translated only once:
+    translations are stored in the "translation_cache" table, keyed by a hash of the backend name and the text.
+
+    Args:
+     -  db_connection (DB_connection): Database in which the cache table is stored.
+     -  backend: Object with a "name" attribute and a "translate_batch(texts)" method (GoogleBackend by default).
+     -  max_workers (int): Number of batches translated concurrently.
+     -  batch_size (int): Number of texts sent to the backend by each task.
+     -  requests_per_second (float): Rate limit shared by all the workers (one request per text). None disables it.
+     -  max_retries (int): Retries of a failed batch, with exponential backoff starting at "backoff" seconds.
+    """
+
+    def __init__(self, db_connection, backend=None, max_workers=8, batch_size=10, requests_per_second=5.0,
+                 max_retries=4, backoff=1.0):
+        self.db_connection = db_connection
+        self.backend = backend if backend is not None else GoogleBackend()
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.rate_limiter = RateLimiter(requests_per_second) if requests_per_second else None
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.db_connection.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CACHE_TABLE} (
+            text_hash TEXT PRIMARY KEY,
+            backend TEXT,
+            source_text TEXT,
+            translation TEXT
+        )
+        """)
+
+    def _lookup(self, hashes):
+        cached = {}
+        for chunk in chunked(hashes, LOOKUP_CHUNK_SIZE):
+            placeholders = ", ".join("?" for _ in chunk)
+            rows = self.db_connection.execute(
+                f"SELECT text_hash, translation FROM {CACHE_TABLE} WHERE text_hash IN ({placeholders})",
+                params=chunk, commit=False
+            )
+            cached.update(rows)
+        return cached
+
+    def _call_backend(self, texts):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(len(texts))
+        with call(f"translation.{self.backend.name}"):
+            return self.backend.translate_batch(texts)
+
+    def _translate_batch(self, texts):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._call_backend(texts)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"Translation failed for a batch of {len(texts)} texts after {attempt + 1} attempts\nError: {e}")
+                    break
+                time.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+
+        if len(texts) == 1:
+            return [None]
+
+        # Translate the texts of the batch one by one, so that a single faulty text does not discard the others
+        translations = []
+        for text in texts:
+            try:
+                translations.append(self._call_backend([text])[0])
+            except Exception as e:
+                print(f"Translation failed for: {text}\nError: {e}")
+                translations.append(None)
+        return translations
+
+    def translate(self, texts):
+        """
+        Returns a dict mapping every non-empty text of "texts" to its translation (None if the translation failed).
+        """
+        distinct_texts = list(dict.fromkeys(t for t in texts if isinstance(t, str) and t.strip()))
+        hashes = {text: text_hash(text, self.backend.name) for text in distinct_texts}
+
+        cached = self._lookup(list(hashes.values()))
+        results = {text: cached[h] for text, h in hashes.items() if h in cached}
+        missing = [text for text in distinct_texts if hashes[text] not in cached]
+
+        if not missing:
+            return results
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self._translate_batch, batch): batch for batch in chunked(missing, self.batch_size)}
+            for future in as_completed(futures):
+                batch = futures[future]
+                translations = future.result()
+                results.update(zip(batch, translations))
+
+                # Failed translations are not cached so that they are retried on the next run
+                self.db_connection.insert_many(
+                    CACHE_TABLE,
+                    ["text_hash", "backend", "source_text", "translation"],
+                    [(hashes[text], self.backend.name, text, translation)
+                     for text, translation in zip(batch, translations) if translation is not None]
+                )
+
+        return results
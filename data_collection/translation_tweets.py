@@ -1,24 +1,31 @@
-from deep_translator import GoogleTranslator
 from DB_connection import DB_connection
+from instrumentation import stage
+from data_collection.translation_engine import TranslationEngine
 
 # === CONFIGURATION ===
-BATCH_SIZE = 100  # Number of tweets per commit
-
-# === TRANSLATION FUNCTION ===
-def preprocess_tweet(text):
-    if not text or not text.strip():
-        return None
-    try:
-        translated = GoogleTranslator(source='auto', target='en').translate(text)
-        return translated
-    except Exception as e:
-        print(f"Translation failed for: {text}\nError: {e}")
-        return None
+BATCH_SIZE = 1000  # Number of tweets per commit
+MAX_WORKERS = 8  # Number of concurrent translation requests
+REQUESTS_PER_SECOND = 5.0  # Rate limit of the translation service
+
+# Rows for which at least one non-empty text has not been translated yet
+UNTRANSLATED_CONDITION = """
+    (text_translation IS NULL AND TRIM(COALESCE(text, '')) != '')
+    OR (quoted_translation IS NULL AND TRIM(COALESCE(quoted_text, '')) != '')
+"""
 
 # === MAIN FUNCTION ===
-def translate_user_timelines(db_connection):
-    columns_df = db_connection.select("PRAGMA table_info(user_timelines);")
-    columns = columns_df["username"].tolist()
+def translate_user_timelines(db_connection, backend=None):
+    """
+    Translates the text and quoted text of every tweet of the 'user_timelines' table into English.
+    Rows that are already translated are skipped, so the function can be resumed after an interruption.
+
+    Args:
+     -  backend: Translation backend used by the TranslationEngine (Google Translate by default).
+
+    Returns:
+        - the number of tweets processed
+    """
+    columns = db_connection.column_names("user_timelines")
 
     if "text_translation" not in columns:
         db_connection.connection.execute("ALTER TABLE user_timelines ADD COLUMN text_translation TEXT;")
@@ -28,28 +35,33 @@ def translate_user_timelines(db_connection):
 
     db_connection.connection.commit()
 
-    tweets_df = db_connection.select("SELECT tweet_id, text, quoted_text FROM user_timelines;")
+    engine = TranslationEngine(db_connection, backend=backend, max_workers=MAX_WORKERS,
+                               requests_per_second=REQUESTS_PER_SECOND)
+    rows_processed = 0
 
-    for i, row in tweets_df.iterrows():
-        tweet_id = row["tweet_id"]
-        text = row["text"]
-        quoted = row["quoted_text"]
+    for rows in db_connection.iter_chunks(
+            "user_timelines", ["text", "quoted_text", "text_translation", "quoted_translation"],
+            chunk_size=BATCH_SIZE, where=UNTRANSLATED_CONDITION, as_frame=False):
+        translations = engine.translate([text for row in rows for text in row[1:3]])
 
-        translation_text = preprocess_tweet(text)
-        translation_quoted = preprocess_tweet(quoted)
+        # Existing translations are kept, only the missing ones are filled in
+        translated_rows = [
+            (
+                text_translation if text_translation is not None else translations.get(text),
+                quoted_translation if quoted_translation is not None else translations.get(quoted),
+                rowid
+            )
+            for rowid, text, quoted, text_translation, quoted_translation in rows
+        ]
+        db_connection.update_many("user_timelines", ["text_translation", "quoted_translation"], translated_rows)
 
-        db_connection.connection.execute("""
-            UPDATE user_timelines
-            SET text_translation = ?, quoted_translation = ?
-            WHERE tweet_id = ?;
-        """, (translation_text, translation_quoted, tweet_id))
+        rows_processed += len(rows)
+        print(f"Translated {rows_processed} tweets...")
 
-        if (i + 1) % BATCH_SIZE == 0:
-            db_connection.connection.commit()
-
-    db_connection.connection.commit()
+    return rows_processed
 
 if __name__ == "__main__":
     db_connection = DB_connection("GOSSIPCOP")
-    translate_user_timelines(db_connection)
+    with stage("translation.user_timelines") as record:
+        record.rows = translate_user_timelines(db_connection)
     db_connection.close()
@@ -1,70 +1,74 @@
 from apify_client import ApifyClient
+from DB_connection import DB_connection
 from dotenv import load_dotenv
 import json
 import os
-import sqlite3
-import time
 
-load_dotenv()
-APIFY_TOKEN = os.getenv("APIFY_TOKEN") # Retrieve the API key to use the scraper
-client = ApifyClient(APIFY_TOKEN)
-
-db_path = "../data/GossipCop/database.db"
-conn = sqlite3.connect(db_path)
-cursor = conn.cursor()
-
-# Retrieve usernames to scrape
-cursor.execute("SELECT username FROM users")
-rows = cursor.fetchall()
-usernames = [row[0] for row in rows]
-
-# Divide usernames to be scraped into batches
-def chunked(lst, size):
-    for i in range(0, len(lst), size):
-        yield lst[i:i + size]
-
-for batch in chunked(usernames, 1000):
-    try:
-
-        run_input = {"user_names": batch}
-        run = client.actor("kaitoeasyapi/premium-twitter-user-scraper-pay-per-result").call(run_input=run_input)
-        items = client.dataset(run["defaultDatasetId"]).list_items().items
-
-        if not items:
-            print(f"No results for this batch")
-            continue
-
-        for user_data in items:
-
-            if "core" not in user_data:
-                print(f"User without 'core'")
-                continue
-
-            username = user_data['core']['screen_name']
-
-            raw_bio = user_data.get('profile_bio', {}).get('description', '')
-            bio = raw_bio.replace("\u00A0", " ").strip() or None
-
-            category = None
-            if 'professional' in user_data:
-                categories = user_data['professional'].get('category', [])
-                if isinstance(categories, list) and categories:
-                    category = categories[0].get('name', '').strip()
-
-            full_data = json.dumps(user_data)
-
-            cursor.execute("""
-            UPDATE users
-            SET bio = ?, professional_category = ?, full_data = ?
-            WHERE username = ?
-            """, (bio, category, full_data, username))
-
-        start_push = time.time()
-        conn.commit()
-        end_push = time.time()
-        print(f"[Push={end_push - start_push:.2f}s]")  # Indicate when a batch of user data has been added to the database
-
-    except Exception as e:
-        print(f"Error for batch {batch} : {e}")
-
-conn.close()
+from data_collection.apify_ingest import chunked, get_failed_batches, ingest_batches
+from data_collection.json_features import add_json_feature_columns
+
+ACTOR_ID = "kaitoeasyapi/premium-twitter-user-scraper-pay-per-result"
+BATCH_SIZE = 1000  # Number of usernames per actor run
+STAGE = "user_data"
+
+def extract_user_row(user_data):
+    """
+    Returns the (bio, professional_category, full_data, username) values used to update the 'users' table,
+    or None if the user data has no 'core' field.
+    """
+    if "core" not in user_data:
+        print(f"User without 'core'")
+        return None
+
+    username = user_data['core']['screen_name']
+
+    raw_bio = user_data.get('profile_bio', {}).get('description', '')
+    bio = raw_bio.replace("\u00A0", " ").strip() or None
+
+    category = None
+    if 'professional' in user_data:
+        categories = user_data['professional'].get('category', [])
+        if isinstance(categories, list) and categories:
+            category = categories[0].get('name', '').strip()
+
+    full_data = json.dumps(user_data)
+    return bio, category, full_data, username
+
+def scrape_user_data(db_connection, client, retry_failed=False):
+    """
+    Scrapes the profile of every user of the 'users' table using an Apify actor and stores their bio,
+    professional category and full data.
+
+    Args:
+     -  client: ApifyClient, or any object with the same interface.
+     -  retry_failed (bool): Only scrape the batches that failed in previous runs.
+    """
+    failure_ids = None
+    if retry_failed:
+        failure_ids, batches = get_failed_batches(db_connection, STAGE)
+    else:
+        # Retrieve usernames to scrape
+        rows = db_connection.execute("SELECT username FROM users", commit=False)
+        usernames = [row[0] for row in rows]
+        batches = list(chunked(usernames, BATCH_SIZE))
+
+    def write_page(items):
+        rows = [row for row in map(extract_user_row, items) if row is not None]
+        db_connection.update_many("users", ["bio", "professional_category", "full_data"], rows,
+                                  key="username", commit=False)
+        return len(rows)
+
+    ingest_batches(db_connection, client, ACTOR_ID, STAGE, batches,
+                   build_run_input=lambda batch: {"user_names": batch}, write_page=write_page, failure_ids=failure_ids)
+
+    # Fields of full_data exposed as generated columns (see json_features.py)
+    add_json_feature_columns(db_connection)
+
+if __name__ == "__main__":
+    load_dotenv()
+    APIFY_TOKEN = os.getenv("APIFY_TOKEN") # Retrieve the API key to use the scraper
+    client = ApifyClient(APIFY_TOKEN)
+
+    db_connection = DB_connection("GOSSIPCOP")
+    scrape_user_data(db_connection, client)
+    db_connection.close()
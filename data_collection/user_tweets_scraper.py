@@ -1,79 +1,56 @@
 from apify_client import ApifyClient
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from DB_connection import DB_connection
 from dotenv import load_dotenv
+from instrumentation import call, stage
 import json
 import os
 import time
 
-start_full = time.time()
+from data_collection.json_features import add_json_feature_columns
 
-load_dotenv()
-APIFY_TOKEN = os.getenv("APIFY_TOKEN")  # Retrieve the API key to use the scraper
-client = ApifyClient(APIFY_TOKEN)
+# === CONFIGURATION ===
+ACTOR_ID = "danek/twitter-timeline-ppr"
+MAX_USERS = 1000  # Maximum number of users selected for scraping
+MAX_POSTS = 120  # Number of tweets requested per user
+MAX_IN_FLIGHT = 8  # Number of actor runs in flight at once
+MAX_ATTEMPTS = 3  # Attempts per user and per run
+BACKOFF = 30  # Seconds before the first retry (doubled after each failure)
+PROGRESS_TABLE = "timeline_scrape_progress"
 
-db_connection = DB_connection("GOSSIPCOP")
 
-
-def get_users_to_exclude():
+def get_users_to_exclude(db_connection):
     """
     Exclude users based on certain criteria:
     1. All users who have a professional category.
     2. All users whose X account no longer exists (which means that their "full_data" column is empty).
     3. Users who do not have a professional category and whose bio contains specific keywords.
     4. Among the remaining users, exclude those with less than 100 tweets.
-    """
-
-    to_exclude = set()
-
-    # 1. Exclude all users with a professional category
-    rows = db_connection.select("SELECT username FROM users WHERE professional_category IS NOT NULL")
-    to_exclude.update(rows["username"].tolist())
 
-    # 2. Exclude all users whose X account no longer exists
-    rows = db_connection.select("SELECT username FROM users WHERE full_data IS NULL")
-    to_exclude.update(rows["username"].tolist())
+    Read-only: the "tweet_count" generated column is added to the users table by the setup steps
+    (scrape_user_data() and create_timeline_tables()).
+    """
 
-    # 3. Exclude users with no professional category AND matching bio_translation keywords
-    keyword_query = """
-        SELECT username 
+    query = """
+        SELECT username
         FROM users
-        WHERE professional_category IS NULL
-          AND (
-            bio_translation LIKE '%news%' OR
-            bio_translation LIKE '%media%' OR
-            bio_translation LIKE '%info%' OR
-            bio_translation LIKE '%entertain%' OR
-            bio_translation LIKE '%station%' OR
-            bio_translation LIKE '%radio%' OR
-            bio_translation LIKE '%celebrity%' OR
-            bio_translation LIKE '%celebrities%' OR
-            bio_translation LIKE '%fan%'
-          )
-    """
-    rows = db_connection.select(keyword_query)
-    to_exclude.update(rows["username"].tolist())
-
-    # 4. From remaining users, exclude those with less than 100 tweets
-    remaining_query = """
-        SELECT username, full_data 
-        FROM users 
-        WHERE full_data IS NOT NULL
+        WHERE professional_category IS NOT NULL
+           OR full_data IS NULL
+           OR (
+                bio_translation LIKE '%news%' OR
+                bio_translation LIKE '%media%' OR
+                bio_translation LIKE '%info%' OR
+                bio_translation LIKE '%entertain%' OR
+                bio_translation LIKE '%station%' OR
+                bio_translation LIKE '%radio%' OR
+                bio_translation LIKE '%celebrity%' OR
+                bio_translation LIKE '%celebrities%' OR
+                bio_translation LIKE '%fan%'
+           )
+           OR (json_valid(full_data) AND COALESCE(tweet_count, 0) < 100)  -- Malformed JSON is not excluded
     """
-    rows = db_connection.select(remaining_query)
-    for _, row in rows.iterrows():
-        username = row["username"]
-        if username in to_exclude:
-            continue  # Skip already excluded users
-
-        try:
-            data = json.loads(row["full_data"])
-            tweet_count = data.get("tweet_counts", {}).get("tweets", 0)
-            if tweet_count < 100:
-                to_exclude.add(username)
-        except (json.JSONDecodeError, TypeError):
-            continue  # Skip if JSON is malformed
-
-    return to_exclude
+    rows = db_connection.execute(query, commit=False)
+    return {username for (username,) in rows}
 
 
 def extract_text_and_type(tweet):
@@ -110,15 +87,8 @@ def extract_text_and_type(tweet):
     return raw_text, None, "tweet"
 
 
-def scrape_user_timelines():
-    """
-    Scrapes the latest tweets from user timelines using an Apify actor.
-    The users to scrape are retrieved from the 'users' table, excluding those returned by get_users_to_exclude().
-    The tweets are stored in a 'user_timelines' table with columns: username, label, tweet_id, text, quoted_text,
-    tweet_type, full_data.
-    """
-
-    db_connection.execute(f"""
+def create_timeline_tables(db_connection):
+    db_connection.execute("""
     CREATE TABLE IF NOT EXISTS user_timelines (
         username TEXT,
         label TEXT,
@@ -131,16 +101,38 @@ def scrape_user_timelines():
     )
     """)
 
-    users_to_exclude = get_users_to_exclude()
+    # Scraping status of each selected user: 'pending', 'done' or 'failed'
+    db_connection.execute(f"""
+    CREATE TABLE IF NOT EXISTS {PROGRESS_TABLE} (
+        username TEXT PRIMARY KEY,
+        label TEXT,
+        status TEXT,
+        attempts INTEGER DEFAULT 0,
+        tweet_count INTEGER,
+        last_error TEXT,
+        updated_at TEXT
+    )
+    """)
+
+    # Fields of full_data exposed as generated columns, for users and user_timelines (see json_features.py)
+    add_json_feature_columns(db_connection)
+
+
+def select_users_to_scrape(db_connection, max_users=MAX_USERS, balanced=False):
+    """
+    Returns the (username, label) pairs of the users to scrape, alternating fake and real users.
+
+    Args:
+     -  max_users (int): Maximum number of users returned (None for no limit).
+     -  balanced (bool): Keep the same number of fake and real users.
+    """
+    users_to_exclude = get_users_to_exclude(db_connection)
 
-    # Retrieve users to scrape
     rows = db_connection.select("SELECT username, label FROM users")
     fake_users = []
     real_users = []
 
-    for _, row in rows.iterrows():
-        username = row["username"]
-        label = row["label"]
+    for username, label in rows.itertuples(index=False):
         if username in users_to_exclude:
             continue
         if label == "fake":
@@ -151,50 +143,123 @@ def scrape_user_timelines():
     # Alternate fake and real users for balanced scraping
     min_len = min(len(fake_users), len(real_users))
     interleaved_users = [pair for i in range(min_len) for pair in (fake_users[i], real_users[i])]
-    interleaved_users += fake_users[min_len:] + real_users[min_len:]
-    usernames = interleaved_users
+    if not balanced:
+        interleaved_users += fake_users[min_len:] + real_users[min_len:]
 
-    print(f"Number of users to scrape: {len(usernames)}")
+    return interleaved_users[:max_users] if max_users is not None else interleaved_users
 
-    max_users = 1000
-    for idx, (username, label) in enumerate(usernames):
-        if idx >= max_users:
-            print(f"Scraping stopped after reaching the limit of {max_users} users.")
-            break
 
+def scrape_user_timeline(client, username, max_posts=MAX_POSTS, max_attempts=MAX_ATTEMPTS, backoff=BACKOFF):
+    """
+    Runs the timeline actor for a single user, retrying with exponential backoff.
+
+    Returns:
+        - the rows to insert into 'user_timelines' (without username and label)
+        - the number of attempts made
+    """
+    for attempt in range(1, max_attempts + 1):
         try:
-            run_input = {
-                "username": username,
-                "max_posts": 120
-            }
-            run = client.actor("danek/twitter-timeline-ppr").call(run_input=run_input)
-            items = client.dataset(run["defaultDatasetId"]).list_items().items
-
-            if not items:
-                print(f"No tweet found for {username}")
-                continue
+            with call("apify.actor"):
+                run = client.actor(ACTOR_ID).call(run_input={"username": username, "max_posts": max_posts})
+            with call("apify.dataset"):
+                items = client.dataset(run["defaultDatasetId"]).list_items().items
+            break
+        except Exception:
+            if attempt == max_attempts:
+                raise
+            time.sleep(backoff * 2 ** (attempt - 1))
 
-            for tweet in items:
-                tweet_id = tweet.get("tweet_id")
-                user_text, quoted_text, tweet_type = extract_text_and_type(tweet)
-                full_data = json.dumps(tweet)
+    rows = []
+    for tweet in items:
+        user_text, quoted_text, tweet_type = extract_text_and_type(tweet)
+        rows.append((tweet.get("tweet_id"), user_text, quoted_text, tweet_type, json.dumps(tweet)))
+    return rows, attempt
 
+
+def scrape_user_timelines(db_connection, client, max_users=MAX_USERS, max_in_flight=MAX_IN_FLIGHT,
+                          max_attempts=MAX_ATTEMPTS, backoff=BACKOFF, balanced=False):
+    """
+    Scrapes the latest tweets from user timelines using an Apify actor.
+    The users to scrape are retrieved from the 'users' table, excluding those returned by get_users_to_exclude().
+    The tweets are stored in a 'user_timelines' table with columns: username, label, tweet_id, text, quoted_text,
+    tweet_type, full_data.
+
+    Up to "max_in_flight" actor runs are executed at once. The status of every selected user is recorded in the
+    progress table, so a new call only scrapes the users that are still pending or have failed.
+
+    Args:
+     -  client: ApifyClient, or any object with the same interface (e.g. LocalApifyClient for offline tests).
+     -  max_users (int): Maximum number of users selected for scraping.
+     -  max_attempts (int): Attempts per user, separated by an exponential backoff starting at "backoff" seconds.
+     -  balanced (bool): Select the same number of fake and real users.
+
+    Returns:
+        - the number of tweets saved
+    """
+    create_timeline_tables(db_connection)
+
+    selected_users = select_users_to_scrape(db_connection, max_users, balanced)
+    db_connection.insert_many(PROGRESS_TABLE, ["username", "label", "status"],
+                              [(username, label, "pending") for username, label in selected_users])
+
+    done = set(db_connection.select(f"SELECT username FROM {PROGRESS_TABLE} WHERE status = 'done'")["username"])
+    usernames = [(username, label) for username, label in selected_users if username not in done]
+
+    print(f"Number of users to scrape: {len(usernames)} ({len(selected_users) - len(usernames)} already done)")
+
+    saved_tweets = 0
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        futures = {
+            pool.submit(scrape_user_timeline, client, username, MAX_POSTS, max_attempts, backoff): (username, label)
+            for username, label in usernames
+        }
+
+        for future in as_completed(futures):
+            username, label = futures[future]
+            try:
+                rows, attempts = future.result()
+            except Exception as e:
+                print(f"Error for user @{username}: {e}")
                 db_connection.execute(f"""
-                INSERT OR IGNORE INTO user_timelines (username, label, tweet_id, text, quoted_text, tweet_type, full_data)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, params=(username, label, tweet_id, user_text, quoted_text, tweet_type, full_data), commit=False)
+                    UPDATE {PROGRESS_TABLE}
+                    SET status = 'failed', attempts = attempts + ?, last_error = ?, updated_at = datetime('now')
+                    WHERE username = ?
+                """, params=(max_attempts, str(e), username))
+                continue
 
-            db_connection.commit()
+            db_connection.insert_many(
+                "user_timelines",
+                ["username", "label", "tweet_id", "text", "quoted_text", "tweet_type", "full_data"],
+                [(username, label, *row) for row in rows],
+                commit=False
+            )
+            db_connection.execute(f"""
+                UPDATE {PROGRESS_TABLE}
+                SET status = 'done', attempts = attempts + ?, tweet_count = ?, last_error = NULL,
+                    updated_at = datetime('now')
+                WHERE username = ?
+            """, params=(attempts, len(rows), username))
+
+            saved_tweets += len(rows)
+            if rows:
+                print(f"{len(rows)} tweets saved for {username}")
+            else:
+                print(f"No tweet found for {username}")
 
-            print(f"{len(items)} tweets saved for {username}")
+    return saved_tweets
 
-        except Exception as e:
-            print(f"Error for user @{username}: {e}")
-            continue
 
+if __name__ == "__main__":
+    start_full = time.time()
+
+    load_dotenv()
+    APIFY_TOKEN = os.getenv("APIFY_TOKEN")  # Retrieve the API key to use the scraper
+    client = ApifyClient(APIFY_TOKEN)
 
-# Use of the function
-scrape_user_timelines()
+    db_connection = DB_connection("GOSSIPCOP")
+    with stage("apify.user_timelines") as record:
+        record.rows = scrape_user_timelines(db_connection, client)
+    db_connection.close()
 
-end_full = time.time()
-print(f"[Total_time={end_full - start_full:.2f}s]")
+    end_full = time.time()
+    print(f"[Total_time={end_full - start_full:.2f}s]")
@@ -0,0 +1,241 @@
+"""
+Stage-level instrumentation of the pipeline, disabled unless PIPELINE_METRICS is set.
+
+Environment variables:
+ -  PIPELINE_METRICS: JSONL file to which the metrics are appended (one record per stage).
+ -  PIPELINE_PROFILE: Names of the stages to profile, separated by commas ("*" for every stage).
+ -  PIPELINE_PROFILER: "cprofile" (default, .prof files readable with pstats/snakeviz) or "sampling"
+    (.folded stack samples, readable with flamegraph tools). Profiles are written next to the metrics file.
+
+Usage:
+    with stage("sentiment.scoring") as record:
+        ...
+        record.rows += n  # Rows processed, to compute the throughput
+
+    with call("apify.actor"):  # External call: count, total and maximum latency added to the current stage
+        ...
+"""
+import atexit
+from collections import Counter
+from contextlib import contextmanager
+import cProfile
+from datetime import datetime, timezone
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+METRICS_PATH = os.getenv("PIPELINE_METRICS")
+PROFILED_STAGES = {name.strip() for name in os.getenv("PIPELINE_PROFILE", "").split(",") if name.strip()}
+PROFILER = os.getenv("PIPELINE_PROFILER", "cprofile")
+SAMPLING_INTERVAL = 0.005  # Seconds between two stack samples of the sampling profiler
+
+_lock = threading.Lock()
+_active_stages = []  # Stages currently running (any thread), innermost last
+_profiling = threading.Lock()  # Held by the running profiler: only one profiler runs at a time
+
+
+def enabled():
+    return METRICS_PATH is not None
+
+
+def peak_memory_mb():
+    """
+    Peak resident memory of the process so far, in MB (None when unavailable).
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10, 1)  # Bytes on macOS, KB on Linux
+
+
+def write_record(record):
+    line = json.dumps(record, default=str)
+    with _lock:
+        with open(METRICS_PATH, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class StageRecord:
+    """
+    Metrics of a running stage. "rows" and "fields" can be updated inside the with block.
+    """
+
+    def __init__(self, name, rows=0, **fields):
+        self.name = name
+        self.rows = rows
+        self.fields = fields
+        self.calls = {}
+
+    def add_call(self, name, seconds):
+        stats = self.calls.setdefault(name, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        stats["count"] += 1
+        stats["total_seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+
+def _calls_summary(calls):
+    return {
+        name: {"count": stats["count"], "total_seconds": round(stats["total_seconds"], 4),
+               "mean_seconds": round(stats["total_seconds"] / stats["count"], 4),
+               "max_seconds": round(stats["max_seconds"], 4)}
+        for name, stats in calls.items()
+    }
+
+
+@contextmanager
+def stage(name, rows=0, **fields):
+    """
+    Records the wall time, the rows processed per second, the external calls and the peak memory of the block
+    as one JSONL record. Extra keyword arguments are added to the record.
+    """
+    record = StageRecord(name, rows, **fields)
+    if not enabled():
+        yield record
+        return
+
+    with _lock:
+        _active_stages.append(record)
+    started_at = datetime.now(timezone.utc).isoformat()
+    profiler = start_profiler(name)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield record
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        stop_profiler(profiler, name)
+        with _lock:
+            _active_stages.remove(record)
+        write_record({
+            "stage": name,
+            "started_at": started_at,
+            "seconds": round(seconds, 4),
+            "rows": record.rows,
+            "rows_per_second": round(record.rows / seconds, 2) if record.rows and seconds > 0 else None,
+            "peak_memory_mb": peak_memory_mb(),
+            "calls": _calls_summary(record.calls),
+            "error": error,
+            "pid": os.getpid(),
+            **record.fields,
+        })
+
+
+@contextmanager
+def call(name):
+    """
+    Measures the latency of an external call (database query, API request, model inference...). The latencies
+    are summarized in the record of the innermost running stage, or in a "process" record at exit.
+    """
+    if not enabled():
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        with _lock:
+            (_active_stages[-1] if _active_stages else _process_record).add_call(name, seconds)
+
+
+def timed(name):
+    """
+    Decorator measuring every call of a function with call(name).
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with call(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Calls made outside any stage, written when the process exits
+_process_record = StageRecord("process")
+
+@atexit.register
+def _write_process_calls():
+    if enabled() and _process_record.calls:
+        write_record({"stage": "process", "pid": os.getpid(), "peak_memory_mb": peak_memory_mb(),
+                      "calls": _calls_summary(_process_record.calls)})
+
+
+# === PROFILING ===
+def _profile_path(name, extension):
+    folder = os.path.dirname(os.path.abspath(METRICS_PATH))
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return os.path.join(folder, f"{name}-{timestamp}-{os.getpid()}.{extension}")
+
+
+class SamplingProfiler:
+    """
+    Samples the call stack of one thread every SAMPLING_INTERVAL seconds from a background thread.
+    The samples are written in the "folded" format: one line per distinct stack, followed by its count.
+    """
+
+    def __init__(self, thread_id, interval=SAMPLING_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def start_profiler(name):
+    if not (name in PROFILED_STAGES or "*" in PROFILED_STAGES) or not _profiling.acquire(blocking=False):
+        return None
+    if PROFILER == "sampling":
+        profiler = SamplingProfiler(threading.get_ident())
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    return profiler
+
+
+def stop_profiler(profiler, name):
+    if profiler is None:
+        return
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        profiler.dump_stats(_profile_path(name, "prof"))
+    else:
+        profiler.stop()
+        profiler.dump(_profile_path(name, "folded"))
+    _profiling.release()
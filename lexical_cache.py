@@ -0,0 +1,187 @@
+from collections import OrderedDict
+import functools
+import os
+import pickle
+
+DEFAULT_MAXSIZE = 200000  # Maximum number of entries kept per memoized function
+
+
+class LRUCache:
+    """
+    Bounded mapping keeping the most recently used entries, with hit/miss counters.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, entries=None):
+        self.maxsize = maxsize
+        self.entries = OrderedDict(entries or {})
+        self.hits = 0
+        self.misses = 0
+        self.added = []  # Keys computed since the last call to pop_added()
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            value = compute(key)
+            self.entries[key] = value
+            self.added.append(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+            return value
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def get_or_compute_many(self, keys, compute_many):
+        """
+        Same as get_or_compute for a list of keys: the distinct missing keys are computed in a single call to
+        compute_many(missing_keys), which returns their values in the same order.
+        """
+        values = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            if key in self.entries:
+                values[key] = self.entries[key]
+                self.entries.move_to_end(key)
+            else:
+                missing.append(key)
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            for key, value in zip(missing, compute_many(missing)):
+                values[key] = value
+                self.entries[key] = value
+                self.added.append(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return [values[key] for key in keys]
+
+    def pop_added(self):
+        added = {key: self.entries[key] for key in self.added if key in self.entries}
+        self.added = []
+        return added
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class LexicalCache:
+    """
+    Memoization layer for the lexical lookups of the preprocessing scripts (WordNet synsets, antonyms, lemmas of
+    the TSA preprocessing, lemmatized tweets of the thematic preprocessing...). Tweet vocabulary is very
+    repetitive, so most of these lookups are answered from memory.
+
+    The cached values are saved to "path" with save() and reloaded at the next run by load(), as long as the
+    signature (e.g. the versions of the resources used) is the same.
+
+    Args:
+     -  path (str): Pickle file where the cache is persisted (None: not persisted).
+     -  signature: Any picklable value identifying the resources used to compute the cached values.
+     -  maxsize (int): Maximum number of entries per memoized function.
+     -  enabled (bool): If False, the memoized functions are always called directly.
+    """
+
+    def __init__(self, path=None, signature=None, maxsize=DEFAULT_MAXSIZE, enabled=True):
+        self.path = path
+        self.signature = signature
+        self.maxsize = maxsize
+        self.enabled = enabled
+        self.caches = {}
+        self.stored = {}
+        if path:
+            self.load(path, signature)
+
+    def load(self, path, signature=None):
+        """
+        Loads the entries saved in "path" if they were computed with the same signature.
+        """
+        self.path = path
+        self.signature = signature
+        if not (self.enabled and os.path.exists(path)):
+            return
+        with open(path, "rb") as f:
+            content = pickle.load(f)
+        if content.get("signature") == signature:
+            self.stored = content["caches"]
+            for name, cache in self.caches.items():
+                self.update({name: self.stored.pop(name, {})})
+
+    def cache(self, name):
+        if name not in self.caches:
+            self.caches[name] = LRUCache(self.maxsize, self.stored.pop(name, None))
+        return self.caches[name]
+
+    def memoize(self, name):
+        """
+        Decorator memoizing a function of one hashable argument under "name".
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(key):
+                if not self.enabled:
+                    return function(key)
+                return self.cache(name).get_or_compute(key, function)
+            wrapper.uncached = function
+            return wrapper
+        return decorator
+
+    def update(self, entries):
+        """
+        Adds entries computed elsewhere (e.g. by worker processes): {name: {key: value}}.
+        """
+        for name, values in entries.items():
+            cache = self.cache(name)
+            for key, value in values.items():
+                cache.entries.setdefault(key, value)
+            while len(cache.entries) > cache.maxsize:
+                cache.entries.popitem(last=False)
+
+    def collect(self):
+        """
+        Returns the entries computed and the hits/misses counted since the last call, then resets the counters.
+        Used to send the work of a worker process back to the main process (see merge()).
+        """
+        collected = {
+            name: {"entries": cache.pop_added(), "hits": cache.hits, "misses": cache.misses}
+            for name, cache in self.caches.items()
+        }
+        for cache in self.caches.values():
+            cache.hits = cache.misses = 0
+        return collected
+
+    def merge(self, collected):
+        self.update({name: values["entries"] for name, values in collected.items()})
+        for name, values in collected.items():
+            cache = self.cache(name)
+            cache.hits += values["hits"]
+            cache.misses += values["misses"]
+
+    def save(self):
+        if not (self.enabled and self.path):
+            return
+        caches = dict(self.stored)
+        caches.update({name: cache.entries for name, cache in self.caches.items()})
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"signature": self.signature, "caches": caches}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+    def stats(self):
+        """
+        Returns {name: {"hits", "misses", "hit_rate", "size"}} for each memoized function.
+        """
+        return {
+            name: {"hits": cache.hits, "misses": cache.misses, "hit_rate": cache.hit_rate(),
+                   "size": len(cache.entries)}
+            for name, cache in self.caches.items()
+        }
+
+    def print_stats(self):
+        for name, stats in self.stats().items():
+            print(f"{name}: {stats['hit_rate']:.1%} hits ({stats['hits']} hits, {stats['misses']} misses, "
+                  f"{stats['size']} entries)")
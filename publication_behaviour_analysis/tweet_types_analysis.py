@@ -1,3 +1,4 @@
+from analysis_cache import load_analysis_table
 from DB_connection import DB_connection
 import matplotlib.pyplot as plt
 import numpy as np
@@ -5,11 +6,7 @@ import pandas as pd
 from scipy.stats import mannwhitneyu
 
 def fetch_retweet_proportions(db_connection):
-    query = """
-    SELECT username, label, tweet_type
-    FROM filtered_user_timelines
-    """
-    df = db_connection.select(query)
+    df = load_analysis_table(db_connection, "timelines", columns=["username", "label", "tweet_type"])
 
     def compute_proportions(group):
         total = len(group)
@@ -60,7 +57,7 @@ def run_mann_whitney_test(fake_scores, real_scores):
         print("No significant difference detected (p >= 0.05).")
 
 def main():
-    db_connection = DB_connection("GOSSIPCOP")
+    db_connection = DB_connection("GOSSIPCOP", read_only=True)
     proportions = fetch_retweet_proportions(db_connection)
     fake_scores, real_scores = split_proportions_by_label(proportions)
     print_proportion_statistics(fake_scores, real_scores)
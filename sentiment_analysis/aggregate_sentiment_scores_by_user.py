@@ -1,21 +1,157 @@
-import pickle
-
-# Load sentiment scores per tweet
-with open("sentiment_scores_by_user.pkl", "rb") as f:
-    scores_by_user = pickle.load(f)
-
-# Compute the overall sentiment score for each user
-global_sentiment_scores = {}
-
-for username, tweet_scores in scores_by_user.items():
-    tweet_values = list(tweet_scores.values())
-    if tweet_values:
-        abs_scores = [abs(score) for score in tweet_values]
-        global_score = round(sum(abs_scores) / len(abs_scores), 4)
-    else:
-        global_score = 0.0
-    global_sentiment_scores[username] = global_score
-
-output_filename = "global_sentiment_scores_by_user.pkl"
-with open(output_filename, "wb") as f:
-    pickle.dump(global_sentiment_scores, f)
+from DB_connection import DB_connection
+from instrumentation import stage
+import numpy as np
+import pandas as pd
+from sentiment_analysis.sentiment_tables import create_sentiment_tables, DIRTY_USERS_TABLE, TWEET_SCORES_TABLE
+
+USER_SCORES_TABLE = "user_sentiment_scores"
+USER_SCORES_COLUMNS = ["username", "label", "tweet_count", "mean_abs_score", "mean_score", "variance",
+                       "q25", "median", "q75", "positive_share", "negative_share", "neutral_share"]
+CHECK_USER_STATISTICS = False  # Compare the statistics with the per-user computation before writing them
+
+def create_user_scores_table(db_connection):
+    db_connection.execute(f"""
+    CREATE TABLE IF NOT EXISTS {USER_SCORES_TABLE} (
+        username TEXT PRIMARY KEY,
+        label TEXT,
+        tweet_count INTEGER,
+        mean_abs_score REAL,  -- Overall sentiment score of the user
+        mean_score REAL,
+        variance REAL,
+        q25 REAL,
+        median REAL,
+        q75 REAL,
+        positive_share REAL,
+        negative_share REAL,
+        neutral_share REAL
+    )
+    """)
+    db_connection.execute(f"CREATE INDEX IF NOT EXISTS idx_{USER_SCORES_TABLE}_label ON {USER_SCORES_TABLE} (label)")
+
+# Compute the statistics of each user from a flat (username, label, score) frame, ordered by user and tweet.
+# Sums are computed with np.bincount, which adds the scores in row order: the mean absolute score is the same,
+# to the last bit, as the sum of the scores of the user in the order of their tweets.
+def compute_user_statistics(df):
+    codes, usernames = pd.factorize(df["username"], sort=False)
+    scores = df["score"].to_numpy(dtype=np.float64)
+    user_count = len(usernames)
+
+    tweet_count = np.bincount(codes, minlength=user_count)
+    abs_sum = np.bincount(codes, weights=np.abs(scores), minlength=user_count)
+    score_sum = np.bincount(codes, weights=scores, minlength=user_count)
+
+    grouped = df["score"].groupby(codes)
+    quantiles = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+
+    stats = pd.DataFrame({
+        "username": usernames,
+        "label": df["label"].groupby(codes).first().to_numpy(),
+        "tweet_count": tweet_count,
+        "mean_abs_score": [round(value, 4) for value in (abs_sum / tweet_count).tolist()],
+        "mean_score": score_sum / tweet_count,
+        "variance": grouped.var(ddof=0).to_numpy(),
+        "q25": quantiles[0.25].to_numpy(),
+        "median": quantiles[0.5].to_numpy(),
+        "q75": quantiles[0.75].to_numpy(),
+        "positive_share": np.bincount(codes, weights=scores > 0, minlength=user_count) / tweet_count,
+        "negative_share": np.bincount(codes, weights=scores < 0, minlength=user_count) / tweet_count,
+        "neutral_share": np.bincount(codes, weights=scores == 0, minlength=user_count) / tweet_count,
+    })
+    return stats[USER_SCORES_COLUMNS]
+
+# Reference implementation of compute_user_statistics, user by user with a pandas groupby (the mean absolute
+# score is computed as in the original aggregation)
+def compute_user_statistics_per_user(df):
+    rows = []
+    for username, user_df in df.groupby("username", sort=False):
+        scores = user_df["score"].astype(np.float64)
+        abs_scores = [abs(score) for score in scores.tolist()]
+        rows.append({
+            "username": username,
+            "label": user_df["label"].iloc[0],
+            "tweet_count": len(scores),
+            "mean_abs_score": round(sum(abs_scores) / len(abs_scores), 4),
+            "mean_score": scores.mean(),
+            "variance": scores.var(ddof=0),
+            "q25": scores.quantile(0.25),
+            "median": scores.quantile(0.5),
+            "q75": scores.quantile(0.75),
+            "positive_share": (scores > 0).mean(),
+            "negative_share": (scores < 0).mean(),
+            "neutral_share": (scores == 0).mean(),
+        })
+    return pd.DataFrame(rows, columns=USER_SCORES_COLUMNS)
+
+def check_user_statistics(stats, reference_stats, rtol=1e-9, atol=1e-12):
+    """
+    Returns the usernames whose statistics differ between two results. The number of tweets, the label and the
+    mean absolute score (the overall sentiment score) must be equal; the other statistics are computed in another
+    order, so they are only equal up to rounding errors.
+    """
+    if stats["username"].tolist() != reference_stats["username"].tolist():
+        raise ValueError("The two results do not contain the same users")
+    exact_columns = ["label", "tweet_count", "mean_abs_score"]
+    close_columns = [column for column in USER_SCORES_COLUMNS[1:] if column not in exact_columns]
+
+    mismatches = np.zeros(len(stats), dtype=bool)
+    for column in exact_columns:
+        mismatches |= stats[column].to_numpy() != reference_stats[column].to_numpy()
+    for column in close_columns:
+        mismatches |= ~np.isclose(stats[column].to_numpy(dtype=np.float64),
+                                  reference_stats[column].to_numpy(dtype=np.float64),
+                                  rtol=rtol, atol=atol, equal_nan=True)
+    return stats["username"][mismatches].tolist()
+
+def aggregate_sentiment_scores(db_connection, full_rebuild=False, check=CHECK_USER_STATISTICS):
+    """
+    Recomputes the statistics of the users whose tweet scores changed since the last aggregation (every user
+    if the user table is empty or full_rebuild is True) and writes them, with the label of the user, to
+    USER_SCORES_TABLE. If check is True, the statistics are first compared with the per-user computation.
+
+    Returns:
+        - the number of users recomputed
+    """
+    create_sentiment_tables(db_connection)
+    create_user_scores_table(db_connection)
+    if full_rebuild or db_connection.select_single_value(f"SELECT COUNT(*) FROM {USER_SCORES_TABLE}") == 0:
+        db_connection.execute(f"INSERT OR IGNORE INTO {DIRTY_USERS_TABLE} SELECT DISTINCT username FROM {TWEET_SCORES_TABLE}")
+
+    # Load sentiment scores per tweet, for the users to update only
+    df = db_connection.select(f"""
+        SELECT s.username, (SELECT label FROM users u WHERE u.username = s.username) AS label, s.score
+        FROM {DIRTY_USERS_TABLE} d
+        JOIN {TWEET_SCORES_TABLE} s ON s.username = d.username
+        ORDER BY s.username, s.tweet_index
+    """)
+    dirty_count = db_connection.select_single_value(f"SELECT COUNT(*) FROM {DIRTY_USERS_TABLE}")
+
+    rows = []
+    if not df.empty:
+        stats = compute_user_statistics(df)
+        if check:
+            mismatches = check_user_statistics(stats, compute_user_statistics_per_user(df))
+            if mismatches:
+                raise ValueError(f"{len(mismatches)} user statistics do not match, e.g. {mismatches[:5]}")
+        rows = [tuple(None if pd.isna(value) else value for value in row)
+                for row in stats.astype(object).itertuples(index=False, name=None)]
+
+    try:
+        # Users without scored tweets anymore are removed as well
+        db_connection.execute(f"DELETE FROM {USER_SCORES_TABLE} WHERE username IN (SELECT username FROM {DIRTY_USERS_TABLE})",
+                              commit=False)
+        db_connection.insert_many(USER_SCORES_TABLE, USER_SCORES_COLUMNS, rows, on_conflict=None, commit=False)
+        db_connection.execute(f"DELETE FROM {DIRTY_USERS_TABLE}", commit=False)
+        db_connection.commit()
+    except Exception:
+        db_connection.connection.rollback()
+        raise
+
+    return dirty_count
+
+if __name__ == "__main__":
+    db_connection = DB_connection("GOSSIPCOP")
+    with stage("sentiment.aggregate") as record:
+        updated_users = aggregate_sentiment_scores(db_connection)
+        record.rows = updated_users
+    print(f"{updated_users} users updated in {USER_SCORES_TABLE}")
+    db_connection.close()
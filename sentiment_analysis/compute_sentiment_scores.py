@@ -1,15 +1,58 @@
+from DB_connection import DB_connection
+from instrumentation import stage
 import json
+import nltk
 from nltk.corpus import sentiwordnet as swn
-import pickle
+from nltk.corpus import wordnet
+import os
+import re
+from sentiment_analysis.ngram_store import generate_ngrams, NgramStore
+from sentiment_analysis.polarity_lexicon import check_polarity_lexicon, POLARITY_LEXICON_PATH, PolarityLexicon
+from sentiment_analysis.senticnet_trie import find_multiword_matches, load_senticnet_store, SENTICNET_STORE_PATH
+from sentiment_analysis.sentiment_tables import create_sentiment_tables, tokens_hash, TWEET_SCORES_TABLE
 from tqdm import tqdm
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
-# Load the VADER lexicon
-vader_analyzer = SentimentIntensityAnalyzer()
-
-# Load the SenticNet lexicon
-with open("senticnet.json", "r", encoding="utf-8") as f:
-    senticnet = json.load(f)
+NGRAM_STORE_FOLDER = "preprocessed_TSA_tokens/"
+CHECK_POLARITY_LEXICON = False  # Compare the polarity lexicon with the original per-term lookups before scoring
+SCORER_VERSION = 1  # To be incremented when the scoring changes, so that every tweet is scored again
+COMMIT_EVERY = 500  # Number of users between two commits
+
+# VADER lexicon, SenticNet polarities (with the index of the multiword keys) and polarity lexicon of the unigrams,
+# loaded by init_resources()
+vader_analyzer = None
+senticnet_polarities = None
+multiword_prefixes = None
+polarity_lexicon = None
+
+def init_resources(senticnet_folder="", polarity_lexicon_path=POLARITY_LEXICON_PATH):
+    """
+    Loads the lexicons. The SenticNet files ("senticnet_store.pkl", or "senticnet.json") are read from
+    senticnet_folder (by default the current folder) and the polarity lexicon is persisted in polarity_lexicon_path.
+    """
+    global vader_analyzer, senticnet_polarities, multiword_prefixes, polarity_lexicon
+
+    # Load the VADER lexicon
+    vader_analyzer = SentimentIntensityAnalyzer()
+
+    # Load the SenticNet polarities and the index of the multiword keys
+    store_path = os.path.join(senticnet_folder, SENTICNET_STORE_PATH)
+    json_path = os.path.join(senticnet_folder, "senticnet.json")
+    senticnet_polarities, multiword_prefixes = load_senticnet_store(store_path, json_path)
+    senticnet_path = store_path if os.path.exists(store_path) else json_path
+
+    # Polarity of the unigrams (SentiWordNet -> SenticNet -> VADER), resolved once per term
+    # The SentiWordNet scores depend on its data file and on the WordNet synsets it is looked up with
+    polarity_lexicon = PolarityLexicon(
+        senticnet_polarities,
+        vader_analyzer.lexicon,
+        path=polarity_lexicon_path,
+        signature=(nltk.__version__, wordnet.get_version(), tuple(swn.fileids()), os.path.getmtime(senticnet_path),
+                   len(vader_analyzer.lexicon)),
+    )
+
+# Characters that n-gram keys use as separators
+SEPARATOR_PATTERN = re.compile(r"[_\s]")
 
 # Function that retrieves the sub-ngrams of smaller size
 def get_sub_ngrams(ngram):
@@ -23,52 +66,32 @@ def get_sub_ngrams(ngram):
             sub_ngrams.add(" ".join(tokens[i:i+3]))
     return sub_ngrams
 
-# Function that retrieves the polarity of a term
-def get_polarity(term):
-    # 1. SentiWordNet
-    synsets = list(swn.senti_synsets(term))
-    if synsets:
-        syn = synsets[0]
-        return (syn.pos_score(), syn.neg_score())
-
-    # 2. SenticNet
-    if term in senticnet:
-        polarity = senticnet[term][7]
-        return (polarity if polarity > 0 else 0, -polarity if polarity < 0 else 0)
-
-    # 3. VADER
-    if term in vader_analyzer.lexicon:
-        score = vader_analyzer.lexicon[term] / 4.0  # Normalisation entre -1 et 1
-        return (score if score > 0 else 0, -score if score < 0 else 0)
-
-    return (0, 0)
-
-# Main function that calculates a polarity score per tweet
-def sent_score(fourgrams, trigrams, bigrams, unigrams):
+# Reference function that calculates a polarity score per tweet from its n-grams
+def sent_score_from_ngrams(fourgrams, trigrams, bigrams, unigrams):
     sent_score = 0.0
     term_count = 0
     used_ngrams = set()
     blocked_terms = set()
 
     for f in fourgrams:
-        if f in senticnet and f not in used_ngrams:
-            polarity = senticnet[f][7]
+        if f in senticnet_polarities and f not in used_ngrams:
+            polarity = senticnet_polarities[f]
             sent_score += polarity
             term_count += 1
             used_ngrams.add(f)
             blocked_terms.update(get_sub_ngrams(f))
 
     for t in trigrams:
-        if t in senticnet and t not in used_ngrams and t not in blocked_terms:
-            polarity = senticnet[t][7]
+        if t in senticnet_polarities and t not in used_ngrams and t not in blocked_terms:
+            polarity = senticnet_polarities[t]
             sent_score += polarity
             term_count += 1
             used_ngrams.add(t)
             blocked_terms.update(get_sub_ngrams(t))
 
     for b in bigrams:
-        if b in senticnet and b not in used_ngrams and b not in blocked_terms:
-            polarity = senticnet[b][7]
+        if b in senticnet_polarities and b not in used_ngrams and b not in blocked_terms:
+            polarity = senticnet_polarities[b]
             sent_score += polarity
             term_count += 1
             used_ngrams.add(b)
@@ -76,34 +99,142 @@ def sent_score(fourgrams, trigrams, bigrams, unigrams):
 
     for u in unigrams:
         if u not in used_ngrams and u not in blocked_terms:
-            pos, neg = get_polarity(u)
-            if pos != 0 or neg != 0:
-                sent_score += pos - neg
+            polarity = polarity_lexicon.get(u)
+            if polarity is not None:
+                sent_score += polarity
                 term_count += 1
                 used_ngrams.add(u)
 
     return round(sent_score / term_count, 4) if term_count > 0 else 0.0
 
-# Load pre-processed tweets
-with open("preprocessed_TSA_ngrams_by_user.pkl", "rb") as f:
-    preprocessed_data = pickle.load(f)
-
-scores_by_user = {}
-
-for username in tqdm(preprocessed_data):
-    user_tweets = preprocessed_data[username]
-    tweet_scores = {}
-
-    for idx, tweet_ngrams in enumerate(user_tweets, 1):
-        fourgrams = [t.replace(" ", "_") for t in tweet_ngrams if len(t.split()) == 4]
-        trigrams = [t.replace(" ", "_") for t in tweet_ngrams if len(t.split()) == 3]
-        bigrams = [t.replace(" ", "_") for t in tweet_ngrams if len(t.split()) == 2]
-        unigrams = [t for t in tweet_ngrams if len(t.split()) == 1]
+# Main function that calculates a polarity score per tweet, by scanning its tokens against the SenticNet keys.
+# Multiword keys are counted once per key, from the longest (four words) to the shortest (two words), then the
+# unigrams once per term: the same terms, in the same order, as sent_score_from_ngrams (whose blocked terms are
+# always keys already used, since get_sub_ngrams does not split keys joined by "_").
+def sent_score(tokens):
+    sent_score = 0.0
+    term_count = 0
 
-        score = sent_score(fourgrams, trigrams, bigrams, unigrams)
-        tweet_scores[str(idx)] = score
+    matches = find_multiword_matches(senticnet_polarities, multiword_prefixes, tokens)
+    for n in range(len(matches) - 1, 1, -1):
+        used_keys = set()
+        for key, polarity in matches[n]:
+            if key not in used_keys:
+                sent_score += polarity
+                term_count += 1
+                used_keys.add(key)
+
+    used_unigrams = set()
+    for u in tokens:
+        if u not in used_unigrams:
+            polarity = polarity_lexicon.get(u)
+            if polarity is not None:
+                sent_score += polarity
+                term_count += 1
+                used_unigrams.add(u)
 
-    scores_by_user[username] = tweet_scores
+    return round(sent_score / term_count, 4) if term_count > 0 else 0.0
 
-with open("sentiment_scores_by_user.pkl", "wb") as f:
-    pickle.dump(scores_by_user, f)
+# Function that calculates the polarity score of a tweet from its n-grams, with the reference function
+def score_tweet_from_ngrams(tokens):
+    tweet_ngrams = generate_ngrams(tokens)
+    fourgrams = [t.replace(" ", "_") for t in tweet_ngrams if len(t.split()) == 4]
+    trigrams = [t.replace(" ", "_") for t in tweet_ngrams if len(t.split()) == 3]
+    bigrams = [t.replace(" ", "_") for t in tweet_ngrams if len(t.split()) == 2]
+    unigrams = [t for t in tweet_ngrams if len(t.split()) == 1]
+
+    return sent_score_from_ngrams(fourgrams, trigrams, bigrams, unigrams)
+
+# Function that calculates the polarity score of a tweet from its tokens
+def score_tweet(tokens):
+    # Tokens containing "_" or spaces (e.g. multiword antonyms) can form SenticNet keys across token boundaries
+    # that the scan does not find: these tweets are scored with the reference function
+    if SEPARATOR_PATTERN.search("".join(tokens)):
+        return score_tweet_from_ngrams(tokens)
+    return sent_score(tokens)
+
+# Function that updates the scores of the tweets of a user whose position, id or text changed since the last run.
+# Every entry of the timeline is kept, duplicates included. Tweets whose text is unchanged but which moved reuse
+# their previous score: only new texts (or texts scored with other lexicons) are scored.
+def update_user_scores(db_connection, username, tweet_ids, tweets_tokens, signature):
+    existing = {
+        tweet_index: (tweet_id, text_hash)
+        for tweet_index, tweet_id, text_hash in db_connection.execute(
+            f"SELECT tweet_index, tweet_id, text_hash FROM {TWEET_SCORES_TABLE} WHERE username = ?",
+            params=(username,), commit=False)
+    }
+    known_scores = dict(db_connection.execute(
+        f"SELECT text_hash, score FROM {TWEET_SCORES_TABLE} WHERE username = ?", params=(username,), commit=False
+    ))
+
+    changed_rows = []
+    scored_tweets = 0
+    for tweet_index, (tweet_id, tokens) in enumerate(zip(tweet_ids, tweets_tokens), 1):
+        text_hash = tokens_hash(tokens, signature)
+        if existing.get(tweet_index) == (tweet_id, text_hash):
+            continue
+        score = known_scores.get(text_hash)
+        if score is None:
+            score = score_tweet(tokens)
+            known_scores[text_hash] = score
+            scored_tweets += 1
+        changed_rows.append((username, tweet_index, tweet_id, text_hash, score))
+
+    db_connection.insert_many(TWEET_SCORES_TABLE, ["username", "tweet_index", "tweet_id", "text_hash", "score"],
+                              changed_rows, on_conflict="REPLACE", commit=False)
+    db_connection.execute(f"DELETE FROM {TWEET_SCORES_TABLE} WHERE username = ? AND tweet_index > ?",
+                          params=(username, len(tweet_ids)), commit=False)
+    return scored_tweets
+
+def compute_sentiment_scores(db_connection, store):
+    """
+    Scores the tweets of the store and writes the scores to TWEET_SCORES_TABLE, keyed by (username, tweet_index).
+    Only the tweets that are new, or whose pre-processed text (or the lexicons) changed since the last run, are
+    scored again; the scores of the tweets and users no longer in the store are deleted. The users whose scores
+    changed are recorded (by triggers) for the aggregation.
+
+    Returns:
+        - the number of tweets scored
+    """
+    create_sentiment_tables(db_connection)
+    signature = (SCORER_VERSION, polarity_lexicon.signature)
+
+    scored_tweets = 0
+    try:
+        for i, (username, tweet_ids, tweets_tokens) in enumerate(tqdm(store.iter_users(), total=len(store)), 1):
+            scored_tweets += update_user_scores(db_connection, username, tweet_ids, tweets_tokens, signature)
+            if i % COMMIT_EVERY == 0:
+                db_connection.commit()
+
+        db_connection.execute(f"DELETE FROM {TWEET_SCORES_TABLE} WHERE username NOT IN (SELECT value FROM json_each(?))",
+                              params=(json.dumps(store.usernames()),), commit=False)
+        db_connection.commit()
+    except Exception:
+        db_connection.connection.rollback()
+        raise
+
+    return scored_tweets
+
+if __name__ == "__main__":
+    init_resources()
+
+    # Load pre-processed tweets
+    store = NgramStore(NGRAM_STORE_FOLDER)
+
+    # Resolve the polarity of the new terms of the vocabulary
+    added_terms = polarity_lexicon.update(store.vocabulary)
+    polarity_lexicon.save()
+    print(f"{added_terms} terms added to the polarity lexicon ({len(polarity_lexicon)} terms)")
+    if CHECK_POLARITY_LEXICON:
+        with open("senticnet.json", "r", encoding="utf-8") as f:
+            senticnet = json.load(f)
+        mismatches = check_polarity_lexicon(polarity_lexicon, senticnet, vader_analyzer.lexicon, store.vocabulary)
+        if mismatches:
+            raise ValueError(f"{len(mismatches)} terms of the polarity lexicon do not match, e.g. {mismatches[:5]}")
+
+    db_connection = DB_connection("GOSSIPCOP")
+    with stage("sentiment.scoring", users=len(store)) as record:
+        scored_tweets = compute_sentiment_scores(db_connection, store)
+        record.rows = scored_tweets
+    print(f"{scored_tweets} tweets scored")
+    db_connection.close()
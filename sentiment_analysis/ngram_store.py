@@ -0,0 +1,151 @@
+import json
+import os
+import pickle
+
+import numpy as np
+
+SHARD_SIZE = 1000  # Number of users written in each shard file
+VOCABULARY_FILE = "vocabulary.json"
+INDEX_FILE = "index.json"
+
+
+# Function for generating uni-grams, bi-grams, tri-grams and four-grams
+def generate_ngrams(tokens, max_n=4):
+    ngrams = []
+    for n in range(1, max_n + 1):
+        ngrams.extend([" ".join(tokens[i:i+n]) for i in range(len(tokens)-n+1)])
+    return ngrams
+
+
+class NgramStore:
+    """
+    Sharded storage of the pre-processed tweets, written user by user and read back lazily.
+
+    Instead of the expanded 1- to 4-gram strings, each tweet is stored as an array of token ids: the n-grams are
+    rebuilt from the tokens when they are needed. The store is a folder containing:
+     -  shard-XXXX.pkl: a sequence of pickled records (username, tweet_ids, tweet lengths, token ids), SHARD_SIZE
+        users per shard,
+     -  vocabulary.json: the list of the tokens (token id = position in the list),
+     -  index.json: {username: [shard number, byte offset of the user's record]}, in writing order.
+
+    Args:
+     -  folder (str): Folder of the store.
+     -  mode (str): "r" (read), "w" (new store, replacing an existing one) or "a" (append users to a store).
+    """
+
+    def __init__(self, folder, mode="r", shard_size=SHARD_SIZE):
+        self.folder = folder
+        self.mode = mode
+        self.shard_size = shard_size
+        self.shard_file = None
+
+        if mode == "w":
+            os.makedirs(folder, exist_ok=True)
+            for filename in os.listdir(folder):
+                if filename.startswith("shard-") or filename in (VOCABULARY_FILE, INDEX_FILE):
+                    os.remove(os.path.join(folder, filename))
+            tokens, self.index = [], {}
+        elif mode in ("r", "a"):
+            with open(os.path.join(folder, VOCABULARY_FILE), encoding="utf-8") as f:
+                tokens = json.load(f)
+            with open(os.path.join(folder, INDEX_FILE), encoding="utf-8") as f:
+                self.index = json.load(f)
+        else:
+            raise ValueError(f"Unknown mode: {mode}")
+
+        if mode == "r":
+            self.vocabulary = np.array(tokens, dtype=object)
+        else:
+            self.token_ids = {token: i for i, token in enumerate(tokens)}
+            self.users_in_shard = self.shard_size  # The first user appended opens a new shard
+            self.shard_number = max((shard for shard, _ in self.index.values()), default=-1) + 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def usernames(self):
+        return list(self.index)
+
+    def shard_path(self, shard):
+        return os.path.join(self.folder, f"shard-{shard:04d}.pkl")
+
+    # === WRITING ===
+    def append_user(self, username, tweet_ids, tweets_tokens):
+        """
+        Appends the tweets of a user. If the user is already in the store, the new record replaces the old one.
+
+        Args:
+         -  tweet_ids (list): Id of each tweet.
+         -  tweets_tokens (list): Tokens of each tweet (list of lists of strings).
+        """
+        if self.users_in_shard >= self.shard_size:
+            if self.shard_file is not None:
+                self.shard_file.close()
+            self.shard_file = open(self.shard_path(self.shard_number), "ab")
+            self.shard_number += 1
+            self.users_in_shard = 0
+
+        ids = [self.token_ids.setdefault(token, len(self.token_ids)) for tokens in tweets_tokens for token in tokens]
+        record = (
+            username,
+            [str(tweet_id) for tweet_id in tweet_ids],
+            np.array([len(tokens) for tokens in tweets_tokens], dtype=np.int32),
+            np.array(ids, dtype=np.int32),
+        )
+        self.index.pop(username, None)
+        self.index[username] = [self.shard_number - 1, self.shard_file.tell()]
+        pickle.dump(record, self.shard_file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.users_in_shard += 1
+
+    def close(self):
+        if self.mode == "r":
+            return
+        if self.shard_file is not None:
+            self.shard_file.close()
+            self.shard_file = None
+        vocabulary = [None] * len(self.token_ids)
+        for token, i in self.token_ids.items():
+            vocabulary[i] = token
+        for filename, content in [(VOCABULARY_FILE, vocabulary), (INDEX_FILE, self.index)]:
+            tmp_path = os.path.join(self.folder, f"{filename}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(content, f, ensure_ascii=False)
+            os.replace(tmp_path, os.path.join(self.folder, filename))
+
+    # === READING ===
+    def decode(self, record):
+        username, tweet_ids, lengths, ids = record
+        tokens = self.vocabulary[ids].tolist()
+        bounds = np.concatenate(([0], np.cumsum(lengths))).tolist()
+        return username, tweet_ids, [tokens[bounds[i]:bounds[i + 1]] for i in range(len(lengths))]
+
+    def read_user(self, username):
+        """
+        Returns (tweet_ids, tokens of each tweet) for a user.
+        """
+        shard, offset = self.index[username]
+        with open(self.shard_path(shard), "rb") as f:
+            f.seek(offset)
+            _, tweet_ids, tweets_tokens = self.decode(pickle.load(f))
+        return tweet_ids, tweets_tokens
+
+    def iter_users(self):
+        """
+        Yields (username, tweet_ids, tokens of each tweet) for every user, one user at a time, shard by shard.
+        """
+        for shard in sorted({shard for shard, _ in self.index.values()}):
+            with open(self.shard_path(shard), "rb") as f:
+                while True:
+                    offset = f.tell()
+                    try:
+                        record = pickle.load(f)
+                    except EOFError:
+                        break
+                    if self.index.get(record[0]) == [shard, offset]:  # Skip the records replaced since
+                        yield self.decode(record)
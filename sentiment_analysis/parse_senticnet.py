@@ -1,6 +1,7 @@
 from ast import literal_eval
 import json
 import re
+from sentiment_analysis.senticnet_trie import save_senticnet_store, SENTICNET_STORE_PATH
 
 senticnet_dict = {}
 input_path = "senticnet.py"
@@ -25,3 +26,7 @@ with open(output_path, "w", encoding="utf-8") as out:
     json.dump(senticnet_dict, out, ensure_ascii=False, indent=2)
 
 print(f"\n{len(senticnet_dict)} valid entries extracted in '{output_path}'")
+
+# Compact store used for scoring (polarities and multiword keys only)
+save_senticnet_store(senticnet_dict, SENTICNET_STORE_PATH)
+print(f"Polarities and multiword keys saved in '{SENTICNET_STORE_PATH}'")
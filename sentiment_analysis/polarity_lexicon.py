@@ -0,0 +1,130 @@
+import os
+import pickle
+
+from nltk.corpus import sentiwordnet as swn
+
+POLARITY_LEXICON_PATH = "polarity_lexicon.pkl"
+
+
+# Function that resolves the polarity of a term in the three sources, by order of priority
+def resolve_polarity(term, senticnet_polarities, vader_lexicon):
+    # 1. SentiWordNet
+    synsets = list(swn.senti_synsets(term))
+    if synsets:
+        syn = synsets[0]
+        return (syn.pos_score(), syn.neg_score())
+
+    # 2. SenticNet
+    if term in senticnet_polarities:
+        polarity = senticnet_polarities[term]
+        return (polarity if polarity > 0 else 0, -polarity if polarity < 0 else 0)
+
+    # 3. VADER
+    if term in vader_lexicon:
+        score = vader_lexicon[term] / 4.0  # Normalisation entre -1 et 1
+        return (score if score > 0 else 0, -score if score < 0 else 0)
+
+    return (0, 0)
+
+
+# Reference implementation: per-term lookup chain of the original scoring, on the SenticNet entries of
+# senticnet.json (polarity at index 7)
+def get_polarity(term, senticnet, vader_lexicon):
+    # 1. SentiWordNet
+    synsets = list(swn.senti_synsets(term))
+    if synsets:
+        syn = synsets[0]
+        return (syn.pos_score(), syn.neg_score())
+
+    # 2. SenticNet
+    if term in senticnet:
+        polarity = senticnet[term][7]
+        return (polarity if polarity > 0 else 0, -polarity if polarity < 0 else 0)
+
+    # 3. VADER
+    if term in vader_lexicon:
+        score = vader_lexicon[term] / 4.0  # Normalisation entre -1 et 1
+        return (score if score > 0 else 0, -score if score < 0 else 0)
+
+    return (0, 0)
+
+
+class PolarityLexicon:
+    """
+    Polarity of the unigrams, resolved once per term with the SentiWordNet -> SenticNet -> VADER priority
+    (see resolve_polarity) and persisted between runs.
+
+    polarities maps each resolved term to its score (pos - neg), or to None when the term has no polarity
+    (pos == neg == 0). The lexicon is rebuilt from scratch when the signature (e.g. the versions of the sources)
+    changes.
+
+    Args:
+     -  senticnet_polarities (dict): Polarity of each key of SenticNet.
+     -  vader_lexicon (dict): VADER lexicon.
+     -  path (str): Pickle file where the lexicon is persisted.
+     -  signature: Any picklable value identifying the versions of the sources.
+    """
+
+    def __init__(self, senticnet_polarities, vader_lexicon, path=POLARITY_LEXICON_PATH, signature=None):
+        self.senticnet_polarities = senticnet_polarities
+        self.vader_lexicon = vader_lexicon
+        self.path = path
+        self.signature = signature
+        self.polarities = {}
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                content = pickle.load(f)
+            if content.get("signature") == signature:
+                self.polarities = content["polarities"]
+
+    def __len__(self):
+        return len(self.polarities)
+
+    def resolve(self, term):
+        pos, neg = resolve_polarity(term, self.senticnet_polarities, self.vader_lexicon)
+        score = pos - neg if pos != 0 or neg != 0 else None
+        self.polarities[term] = score
+        return score
+
+    def update(self, terms):
+        """
+        Resolves the terms that are not in the lexicon yet. Returns the number of terms added.
+        """
+        missing = [term for term in dict.fromkeys(terms) if term not in self.polarities]
+        for term in missing:
+            self.resolve(term)
+        return len(missing)
+
+    def get(self, term):
+        """
+        Returns the score of a term (None if it has no polarity).
+        """
+        try:
+            return self.polarities[term]
+        except KeyError:
+            return self.resolve(term)
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"signature": self.signature, "polarities": self.polarities}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+
+def check_polarity_lexicon(lexicon, senticnet, vader_lexicon, terms=None):
+    """
+    Compares the lexicon with the original per-term lookup chain (get_polarity), on the SenticNet entries of
+    senticnet.json rather than the polarities of the store, for the given terms (all the terms of the lexicon
+    by default).
+
+    Returns:
+        - the list of (term, score in the lexicon, pos and neg scores of the original lookup) that do not match
+    """
+    mismatches = []
+    for term in lexicon.polarities if terms is None else terms:
+        pos, neg = get_polarity(term, senticnet, vader_lexicon)
+        expected = pos - neg if pos != 0 or neg != 0 else None
+        if lexicon.polarities.get(term, "missing") != expected:
+            mismatches.append((term, lexicon.polarities.get(term), (pos, neg)))
+    return mismatches
@@ -1,27 +1,62 @@
+from analysis_cache import load_analysis_table
+from concurrent.futures import ProcessPoolExecutor
 import contractions
 from DB_connection import DB_connection
 import emoji
+from instrumentation import stage
+from lexical_cache import LexicalCache
 import nltk
 from nltk.corpus import wordnet
 from nltk.stem import WordNetLemmatizer
 from nltk.tokenize import TweetTokenizer
-import pickle
+import os
 import re
+from sentiment_analysis.ngram_store import generate_ngrams, NgramStore
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
-# Download NLTK resources
-nltk.download('wordnet')
-nltk.download('omw-1.4')
-nltk.download('punkt')
+MAX_WORKERS = os.cpu_count()  # Number of worker processes (1: users are processed in the main process)
+CHUNK_SIZE = 50  # Number of users sent to a worker at once
+NGRAM_STORE_FOLDER = "preprocessed_TSA_tokens/"
+
+# Cache of the WordNet lookups and lemmas, reused between runs (cleared when WordNet or VADER change)
+LEXICAL_CACHE_PATH = "lexical_cache.pkl"
+USE_LEXICAL_CACHE = True
+lexical_cache = LexicalCache(enabled=USE_LEXICAL_CACHE)
+
+# Lemmatizer, VADER lexicon and tokeniser, initialised once per process by init_resources()
+lemmatizer = None
+vader_lexicon = None
+tokenizer = None
+
+def init_resources(download=True):
+    global lemmatizer, vader_lexicon, tokenizer
+
+    # Download NLTK resources
+    if download:
+        nltk.download('wordnet')
+        nltk.download('omw-1.4')
+        nltk.download('punkt')
+
+    # Initialise the lemmatizer, the VADER lexicon and the Twitter-aware tokeniser
+    lemmatizer = WordNetLemmatizer()
+    vader_analyzer = SentimentIntensityAnalyzer()
+    vader_lexicon = set(vader_analyzer.lexicon.keys())
+    tokenizer = TweetTokenizer(preserve_case=False, strip_handles=True, reduce_len=True)
+
+    lexical_cache.load(LEXICAL_CACHE_PATH, signature=(nltk.__version__, wordnet.get_version(), len(vader_lexicon)))
+
+# Initialiser of the worker processes (the NLTK resources have already been downloaded by the main process)
+def init_worker():
+    init_resources(download=False)
 
-# Initialise the lemmatizer and the VADER lexicon
-lemmatizer = WordNetLemmatizer()
-vader_analyzer = SentimentIntensityAnalyzer()
-vader_lexicon = set(vader_analyzer.lexicon.keys())
+@lexical_cache.memoize("has_synsets")
+def has_synsets(word):
+    return bool(wordnet.synsets(word))
 
 # Function to remove repeats (elongations)
+@lexical_cache.memoize("reduce_elongation")
 def reduce_elongation(word):
-    if wordnet.synsets(word):
+    if has_synsets(word):
         return word
 
     match = re.findall(r'(.)\1{2,}', word)
@@ -31,26 +66,31 @@ def reduce_elongation(word):
     word_mod = word
 
     while True:
-        if wordnet.synsets(word_mod):
+        if has_synsets(word_mod):
             return word_mod
         new_word = re.sub(r'(.)\1{2,}', lambda m: m.group(0)[:-1], word_mod)
         if new_word == word_mod:
             return new_word
         word_mod = new_word
 
+# Function returning the first antonym of a word in WordNet (None if there is none)
+@lexical_cache.memoize("first_antonym")
+def first_antonym(word):
+    for syn in wordnet.synsets(word):
+        for lemma in syn.lemmas():
+            if lemma.antonyms():
+                return lemma.antonyms()[0].name()
+    return None
+
 # Function for managing negations with antonyms
 def replace_negations(tokens):
     i = 0
     new_tokens = []
     while i < len(tokens):
         if tokens[i] in ['not', 'never'] and i+1 < len(tokens):
-            antonyms = []
-            for syn in wordnet.synsets(tokens[i+1]):
-                for lemma in syn.lemmas():
-                    if lemma.antonyms():
-                        antonyms.append(lemma.antonyms()[0].name())
-            if antonyms:
-                new_tokens.append(antonyms[0])
+            antonym = first_antonym(tokens[i+1])
+            if antonym:
+                new_tokens.append(antonym)
                 i += 2
                 continue
         new_tokens.append(tokens[i])
@@ -58,6 +98,7 @@ def replace_negations(tokens):
     return new_tokens
 
 # "Intelligent" lemmatisation function
+@lexical_cache.memoize("smart_lemmatize")
 def smart_lemmatize(token):
     if token in vader_lexicon:
         return token
@@ -66,15 +107,8 @@ def smart_lemmatize(token):
     else :
         return lemmatizer.lemmatize(token) if token.isalpha() else None
 
-# Function for generating uni-grams, bi-grams, tri-grams and four-grams
-def generate_ngrams(tokens, max_n=4):
-    ngrams = []
-    for n in range(1, max_n + 1):
-        ngrams.extend([" ".join(tokens[i:i+n]) for i in range(len(tokens)-n+1)])
-    return ngrams
-
-# Main pre-treatment function
-def preprocess_tweet(text):
+# Main pre-treatment function, returning the tokens of the tweet
+def preprocess_tweet_tokens(text):
     # 1. Delete URLs, hashtags, mentions
     text = re.sub(r"http\S+|www.\S+|@\w+|#\w+", "", text)
 
@@ -82,7 +116,6 @@ def preprocess_tweet(text):
     text = contractions.fix(text)
 
     # 3. Twitter-aware tokenisation
-    tokenizer = TweetTokenizer(preserve_case=False, strip_handles=True, reduce_len=True)
     tokens = tokenizer.tokenize(text)
 
     # 4. Elongation reduction
@@ -95,32 +128,86 @@ def preprocess_tweet(text):
     # 6. Replacing negations
     tokens = replace_negations(tokens)
 
-    return generate_ngrams(tokens)
-
+    return tokens
 
-# DB connection
-db_connection = DB_connection("GOSSIPCOP")
-df = db_connection.select("SELECT username, text_translation FROM filtered_user_timelines").fillna("")
+# Pre-treatment function returning the n-grams of the tweet
+def preprocess_tweet(text):
+    return generate_ngrams(preprocess_tweet_tokens(text))
 
-# Pre-processing by user
-usernames = df['username'].unique()
-preprocessed_by_user = {}
 
-for idx, username in enumerate(usernames, 1):
-    user_df = df[df['username'] == username]
+# Pre-processing of the tweets of a user: returns the ids and the tokens of the tweets kept
+def preprocess_user(username, tweet_ids, texts):
+    processed_ids = []
     processed_tweets = []
 
-    for text in user_df['text_translation']:
+    for tweet_id, text in zip(tweet_ids, texts):
         if text.strip():
             try:
-                ngrams = preprocess_tweet(text)
-                if ngrams:
-                    processed_tweets.append(ngrams)
+                tokens = preprocess_tweet_tokens(text)
+                if tokens:
+                    processed_ids.append(tweet_id)
+                    processed_tweets.append(tokens)
             except Exception as e:
                 print(f"Error with tweet from {username} : {text[:30]}... → {e}")
 
-    if processed_tweets:
-        preprocessed_by_user[username] = processed_tweets
-
-with open("preprocessed_TSA_ngrams_by_user.pkl", "wb") as f:
-    pickle.dump(preprocessed_by_user, f)
+    return processed_ids, processed_tweets
+
+# Pre-processing of a chunk of users
+def preprocess_users(chunk):
+    return [(username, *preprocess_user(username, tweet_ids, texts)) for username, tweet_ids, texts in chunk]
+
+# Same, in a worker process: the lexical cache entries computed by the worker are sent back with the results
+def preprocess_users_in_worker(chunk):
+    return preprocess_users(chunk), lexical_cache.collect()
+
+def preprocess_all_users(df, store, max_workers=MAX_WORKERS, chunk_size=CHUNK_SIZE):
+    """
+    Pre-processes the tweets of every user of df (columns "username", "tweet_id" and "text_translation") and
+    appends the tokens of the users with at least one pre-processed tweet to the n-gram store, user by user.
+    Users are processed by chunks of chunk_size users in max_workers processes. The results are written
+    in the order of the users in df, so the output is the same as the one of a serial run.
+
+    Returns:
+        - the number of users written
+    """
+    texts_by_user = [(username, user_df['tweet_id'].tolist(), user_df['text_translation'].tolist())
+                     for username, user_df in df.groupby('username', sort=False)]
+    chunks = [texts_by_user[i:i + chunk_size] for i in range(0, len(texts_by_user), chunk_size)]
+
+    if max_workers <= 1:
+        results = ((preprocess_users(chunk), None) for chunk in chunks)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker)
+        results = executor.map(preprocess_users_in_worker, chunks)  # Results are returned in the order of the chunks
+
+    written_users = 0
+    try:
+        for chunk_results, collected in results:
+            if collected is not None:
+                lexical_cache.merge(collected)
+            for username, processed_ids, processed_tweets in chunk_results:
+                if processed_tweets:
+                    store.append_user(username, processed_ids, processed_tweets)
+                    written_users += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return written_users
+
+if __name__ == "__main__":
+    init_resources()
+
+    # DB connection
+    db_connection = DB_connection("GOSSIPCOP", read_only=True)
+    df = load_analysis_table(db_connection, "timelines", columns=["username", "tweet_id", "text_translation"])
+    df["text_translation"] = df["text_translation"].fillna("")
+    db_connection.close()
+
+    with NgramStore(NGRAM_STORE_FOLDER, mode="w") as store, stage("tsa.preprocess", rows=len(df)):
+        written_users = preprocess_all_users(df, store)
+    print(f"{written_users} users written to {NGRAM_STORE_FOLDER}")
+
+    lexical_cache.save()
+    lexical_cache.print_stats()
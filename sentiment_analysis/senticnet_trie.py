@@ -0,0 +1,79 @@
+import gc
+import json
+import os
+import pickle
+
+MAX_WORDS = 4  # Longest multiword keys used for scoring (four-grams)
+SENTICNET_STORE_PATH = "senticnet_store.pkl"
+POLARITY_INDEX = 7  # Position of the polarity value in the SenticNet entries
+
+
+def build_multiword_prefixes(senticnet_polarities, max_words=MAX_WORDS):
+    """
+    Builds the index of the multiword keys of SenticNet (words joined by "_") of 2 to max_words words: the set of
+    their proper prefixes ("a", "a_b" and "a_b_c" for "a_b_c_d"). Together with the keys themselves, the prefixes
+    form a trie stored in two flat hash tables, which are much faster to load than nested nodes.
+    """
+    prefixes = set()
+    for key in senticnet_polarities:
+        words = key.split("_")
+        if not 2 <= len(words) <= max_words:
+            continue
+        for n in range(1, len(words)):
+            prefixes.add("_".join(words[:n]))
+    return prefixes
+
+
+def find_multiword_matches(senticnet_polarities, prefixes, tokens, max_words=MAX_WORDS):
+    """
+    Scans the tokens of a tweet against the multiword keys and returns the keys found, by number of words:
+    matches[n] is the list of (key, polarity) of the n-word keys, in order of position in the tweet.
+    The tokens must not contain "_".
+    """
+    matches = [[] for _ in range(max_words + 1)]
+    token_count = len(tokens)
+    for i in range(token_count):
+        key = tokens[i]
+        if key not in prefixes:
+            continue
+        for j in range(i + 1, min(i + max_words, token_count)):
+            key = f"{key}_{tokens[j]}"
+            polarity = senticnet_polarities.get(key)
+            if polarity is not None:
+                matches[j - i + 1].append((key, polarity))
+            if key not in prefixes:
+                break
+    return matches
+
+
+# === STORE ===
+def save_senticnet_store(senticnet, path=SENTICNET_STORE_PATH):
+    """
+    Saves what the scoring uses from SenticNet: the polarity of each key and the index of the multiword keys.
+    """
+    polarities = {key: value[POLARITY_INDEX] for key, value in senticnet.items()}
+    store = {"polarities": polarities, "multiword_prefixes": build_multiword_prefixes(polarities)}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(store, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_senticnet_store(path=SENTICNET_STORE_PATH, json_path="senticnet.json"):
+    """
+    Returns (polarity of each key, index of the multiword keys). If the store has not been written by
+    parse_senticnet.py, they are computed from the JSON lexicon.
+    """
+    if os.path.exists(path):
+        gc.disable()  # The store only contains strings and floats: no reference cycles to look for while loading
+        try:
+            with open(path, "rb") as f:
+                store = pickle.load(f)
+        finally:
+            gc.enable()
+        return store["polarities"], store["multiword_prefixes"]
+
+    with open(json_path, "r", encoding="utf-8") as f:
+        senticnet = json.load(f)
+    polarities = {key: value[POLARITY_INDEX] for key, value in senticnet.items()}
+    return polarities, build_multiword_prefixes(polarities)
@@ -1,28 +1,13 @@
 from DB_connection import DB_connection
 import matplotlib.pyplot as plt
 import numpy as np
-import pickle
 from scipy.stats import mannwhitneyu, shapiro, probplot
 
-def load_sentiment_scores(pkl_path):
-    with open(pkl_path, 'rb') as f:
-        return pickle.load(f)
-
-def fetch_user_labels(db_connection, usernames):
-    placeholders = ','.join(f"'{u}'" for u in usernames)
-    query = f"SELECT username, label FROM users WHERE username IN ({placeholders})"
-    df_labels = db_connection.select(query)
-    return dict(zip(df_labels['username'], df_labels['label']))
-
-def split_scores_by_label(sentiment_scores, user_labels):
-    fake_scores = []
-    real_scores = []
-    for username, score in sentiment_scores.items():
-        label = user_labels.get(username)
-        if label == 'fake':
-            fake_scores.append(score)
-        elif label == 'real':
-            real_scores.append(score)
+def load_scores_by_label(db_connection, score_column='mean_abs_score'):
+    query = f"SELECT label, {score_column} AS score FROM user_sentiment_scores WHERE label IN ('fake', 'real')"
+    df_scores = db_connection.select(query)
+    fake_scores = df_scores.loc[df_scores['label'] == 'fake', 'score'].tolist()
+    real_scores = df_scores.loc[df_scores['label'] == 'real', 'score'].tolist()
     return fake_scores, real_scores
 
 def plot_score_distributions(fake_scores, real_scores):
@@ -94,12 +79,9 @@ def run_mann_whitney_test(fake_scores, real_scores):
         print("No significant difference detected (p >= 0.05).")
 
 
-def main(pkl_path='global_sentiment_scores_by_user.pkl'):
-    db_connection = DB_connection("GOSSIPCOP")
-    sentiment_scores = load_sentiment_scores(pkl_path)
-    usernames = list(sentiment_scores.keys())
-    user_labels = fetch_user_labels(db_connection, usernames)
-    fake_scores, real_scores = split_scores_by_label(sentiment_scores, user_labels)
+def main(score_column='mean_abs_score'):
+    db_connection = DB_connection("GOSSIPCOP", read_only=True)
+    fake_scores, real_scores = load_scores_by_label(db_connection, score_column)
     print_score_statistics(fake_scores, real_scores)
     plot_score_distributions(fake_scores, real_scores)
     test_normality(fake_scores, real_scores)
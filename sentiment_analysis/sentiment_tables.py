@@ -0,0 +1,60 @@
+import hashlib
+
+TWEET_SCORES_TABLE = "tweet_sentiment_scores"
+DIRTY_USERS_TABLE = "sentiment_dirty_users"
+
+
+def tokens_hash(tokens, signature=None):
+    """
+    Hash of the pre-processed text of a tweet (its tokens) and of the signature of the lexicons used to score it,
+    so that a tweet is scored again when its text or the lexicons change.
+    """
+    content = "\x1f".join([repr(signature), *tokens])
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def create_sentiment_tables(db_connection):
+    """
+    Creates the table of the tweet scores and the table of the users whose scores changed since the last
+    aggregation, filled by triggers on the scores table.
+
+    The scores are keyed by the position of the tweet in the user's timeline, so that a tweet appearing twice
+    is counted twice, as in the timeline. A scores table keyed by tweet id (first version of the table) is
+    dropped: its scores are computed again by the next run.
+    """
+    primary_key = [row[1] for row in db_connection.execute(f"PRAGMA table_info({TWEET_SCORES_TABLE})", commit=False)
+                   if row[5] > 0]
+    if primary_key and "tweet_index" not in primary_key:
+        db_connection.execute(f"DROP TABLE {TWEET_SCORES_TABLE}")
+
+    db_connection.execute(f"""
+    CREATE TABLE IF NOT EXISTS {TWEET_SCORES_TABLE} (
+        username TEXT,
+        tweet_index INTEGER,  -- Position of the tweet in the user's pre-processed tweets
+        tweet_id TEXT,
+        text_hash TEXT,
+        score REAL,
+        PRIMARY KEY (username, tweet_index)
+    )
+    """)
+
+    db_connection.execute(f"CREATE TABLE IF NOT EXISTS {DIRTY_USERS_TABLE} (username TEXT PRIMARY KEY)")
+    db_connection.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS {DIRTY_USERS_TABLE}_insert AFTER INSERT ON {TWEET_SCORES_TABLE}
+    BEGIN
+        INSERT OR IGNORE INTO {DIRTY_USERS_TABLE} VALUES (NEW.username);
+    END
+    """)
+    db_connection.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS {DIRTY_USERS_TABLE}_update AFTER UPDATE ON {TWEET_SCORES_TABLE}
+    BEGIN
+        INSERT OR IGNORE INTO {DIRTY_USERS_TABLE} VALUES (OLD.username);
+        INSERT OR IGNORE INTO {DIRTY_USERS_TABLE} VALUES (NEW.username);
+    END
+    """)
+    db_connection.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS {DIRTY_USERS_TABLE}_delete AFTER DELETE ON {TWEET_SCORES_TABLE}
+    BEGIN
+        INSERT OR IGNORE INTO {DIRTY_USERS_TABLE} VALUES (OLD.username);
+    END
+    """)
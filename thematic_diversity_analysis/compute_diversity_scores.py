@@ -1,8 +1,36 @@
+import glob
 import numpy as np
+import os
 import pandas as pd
 import pickle
+import re
+import scipy.sparse as sp
+
+from thematic_diversity_analysis.doc_topic_matrix import load_doc_topic_matrix
+from thematic_diversity_analysis.doc_topics_count_user import count_doc_topics, read_corpus_usernames
+
+OUTPUT_PATH = "rao_diversity_scores.pkl"
+CHECK_DIVERSITY_SCORES = False  # Compare the batched scores with the per-user computation before saving them
 
 def compute_topic_similarity_cosine(doc_topic_matrix):
+    """
+    Cosine similarity between the topic columns of a document × topic matrix (dense or scipy sparse), computed
+    from the Gram matrix X^T X. The similarity of a topic never assigned is 0.
+    """
+    doc_topic_matrix = doc_topic_matrix.astype(np.int64)  # The counts are stored as int32, their products may not fit
+    gram = doc_topic_matrix.T @ doc_topic_matrix
+    gram = gram.toarray() if sp.issparse(gram) else np.asarray(gram)
+    norms = np.sqrt(np.diag(gram).astype(np.float64))
+
+    similarity_matrix = np.zeros(gram.shape)
+    nonzero = norms > 0
+    similarity_matrix[np.ix_(nonzero, nonzero)] = (
+        gram[np.ix_(nonzero, nonzero)] / (norms[nonzero, None] * norms[None, nonzero])
+    )
+    return similarity_matrix
+
+# Reference implementation of compute_topic_similarity_cosine, column pair by column pair
+def compute_topic_similarity_cosine_loop(doc_topic_matrix):
     n_topics = doc_topic_matrix.shape[1]
     similarity_matrix = np.zeros((n_topics, n_topics))
 
@@ -22,31 +50,100 @@ def compute_topic_similarity_cosine(doc_topic_matrix):
 def compute_rao_diversity(p, dissimilarity_matrix):
     return np.sum(p[:, None] * p[None, :] * dissimilarity_matrix)
 
-# Load the CSV file containing the document-topic count matrix
-df = pd.read_csv("tweet_topic_matrix_with_users.csv")
+def compute_user_topic_distributions(doc_topic_matrix, usernames):
+    """
+    Sums the topic counts of the documents of each user with a single sparse product (users × documents
+    indicator matrix @ documents × topics matrix) and normalises them.
+
+    Returns:
+        - the sorted usernames
+        - the users × topics matrix of topic proportions (rows of zeros for users without any topic assignment)
+    """
+    user_names, codes = np.unique(np.asarray(usernames), return_inverse=True)
+    n_docs = len(codes)
+    user_documents = sp.csr_matrix((np.ones(n_docs), (codes, np.arange(n_docs))), shape=(len(user_names), n_docs))
+
+    user_topic_counts = np.asarray((user_documents @ sp.csr_matrix(doc_topic_matrix)).toarray(), dtype=np.float64)
+    totals = user_topic_counts.sum(axis=1, keepdims=True)
+    distributions = np.divide(user_topic_counts, totals, out=np.zeros_like(user_topic_counts), where=totals > 0)
+    return user_names, distributions
+
+def compute_rao_scores(doc_topic_matrix, usernames):
+    """
+    Rao's diversity score of every user, sum_ij p_i p_j d_ij, where p is the topic distribution of the user and
+    d = 1 - cosine similarity between topics. The scores of all users are computed at once as the diagonal of
+    P D P^T: einsum multiplies the rows of P D and P term by term, without building the users × users product.
+
+    Returns:
+        - {username: {"rao_score": score}}, by alphabetical order of usernames (0 for users without topics)
+    """
+    dissimilarity_matrix = 1 - compute_topic_similarity_cosine(doc_topic_matrix)
+    user_names, distributions = compute_user_topic_distributions(doc_topic_matrix, usernames)
+    scores = np.einsum("ut,ut->u", distributions @ dissimilarity_matrix, distributions)
+    return {str(username): {"rao_score": score} for username, score in zip(user_names, scores)}
+
+# Reference implementation of compute_rao_scores, user by user
+def compute_rao_scores_per_user(doc_topic_matrix, usernames):
+    doc_topic_matrix = sp.csr_matrix(doc_topic_matrix, dtype=np.int64)
+    dissimilarity_matrix = 1 - compute_topic_similarity_cosine_loop(doc_topic_matrix.toarray())
+
+    rao_results = {}
+    for username, rows in pd.Series(np.arange(len(usernames))).groupby(np.asarray(usernames)):
+        user_topic_counts = np.asarray(doc_topic_matrix[rows.to_numpy()].sum(axis=0)).ravel()
+        total = user_topic_counts.sum()
+
+        if total == 0:
+            rao_score = 0.0
+        else:
+            p = user_topic_counts / total
+            rao_score = compute_rao_diversity(p, dissimilarity_matrix)
+
+        rao_results[username] = {"rao_score": rao_score}
+    return rao_results
+
+def check_rao_scores(rao_results, reference_results, rtol=1e-9, atol=1e-12):
+    """
+    Returns the usernames whose scores differ between two results (the batched computation adds the terms in
+    another order, so the scores are only equal up to rounding errors).
+    """
+    if list(rao_results) != list(reference_results):
+        raise ValueError("The two results do not contain the same users")
+    return [username for username in rao_results
+            if not np.isclose(rao_results[username]["rao_score"], reference_results[username]["rao_score"],
+                              rtol=rtol, atol=atol)]
 
-# Identify topic columns
-topic_columns = [col for col in df.columns if col.startswith("topic_")]
+def sweep_rao_scores(state_pattern=os.path.join("mallet_runs", "k*_state.gz"), usernames=None):
+    """
+    Computes the diversity scores of every user for each MALLET run of the comparison of the number of topics
+    (comparison_param_mallet.py), whose state files match state_pattern.
 
-# Calculate the similarity/dissimilarity matrix
-global_topic_matrix = df[topic_columns].values
-similarity_matrix = compute_topic_similarity_cosine(global_topic_matrix)
-dissimilarity_matrix = 1 - similarity_matrix
+    Returns:
+        - {number of topics: {username: {"rao_score": score}}}
+    """
+    if usernames is None:
+        usernames = read_corpus_usernames()
 
-# Compute Rao's diversity score for each user
-rao_results = {}
+    results = {}
+    for state_path in glob.glob(state_pattern):
+        num_topics = int(re.search(r"k(\d+)_state", os.path.basename(state_path)).group(1))
+        doc_topic_matrix = count_doc_topics(state_path)
+        if doc_topic_matrix.shape[0] != len(usernames):
+            raise ValueError(f"Mismatch : {len(usernames)} usernames vs {doc_topic_matrix.shape[0]} documents "
+                             f"in {state_path}")
+        results[num_topics] = compute_rao_scores(doc_topic_matrix, usernames)
+    return dict(sorted(results.items()))
 
-for username, group in df.groupby("username"):
-    user_topic_counts = group[topic_columns].sum().values
-    total = user_topic_counts.sum()
+if __name__ == "__main__":
+    # Load the sparse document-topic count matrix and the username of each document
+    doc_topic_matrix, usernames = load_doc_topic_matrix()
 
-    if total == 0:
-        rao_score = 0.0
-    else:
-        p = user_topic_counts / total
-        rao_score = compute_rao_diversity(p, dissimilarity_matrix)
+    # Compute Rao's diversity score for each user
+    rao_results = compute_rao_scores(doc_topic_matrix, usernames)
 
-    rao_results[username] = {"rao_score": rao_score}
+    if CHECK_DIVERSITY_SCORES:
+        mismatches = check_rao_scores(rao_results, compute_rao_scores_per_user(doc_topic_matrix, usernames))
+        if mismatches:
+            raise ValueError(f"{len(mismatches)} diversity scores do not match, e.g. {mismatches[:5]}")
 
-with open("rao_diversity_scores.pkl", "wb") as f:
-    pickle.dump(rao_results, f)
+    with open(OUTPUT_PATH, "wb") as f:
+        pickle.dump(rao_results, f)
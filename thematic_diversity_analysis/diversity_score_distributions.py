@@ -97,7 +97,7 @@ def run_mann_whitney_test(fake_scores, real_scores):
 
 
 def main(pkl_path='rao_diversity_scores.pkl'):
-    db_connection = DB_connection("GOSSIPCOP")
+    db_connection = DB_connection("GOSSIPCOP", read_only=True)
     rao_scores = load_rao_scores(pkl_path)
     usernames = list(rao_scores.keys())
     user_labels = fetch_user_labels(db_connection, usernames)
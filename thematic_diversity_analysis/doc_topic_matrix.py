@@ -0,0 +1,33 @@
+import numpy as np
+import scipy.sparse as sp
+
+# Tweet × topic count matrix, stored as a sparse CSR matrix (most tweets only have a few topics) with the
+# username of each tweet (row) in a companion array
+MATRIX_PATH = "tweet_topic_matrix.npz"
+USERNAMES_PATH = "tweet_topic_usernames.npz"
+
+
+def save_doc_topic_matrix(matrix, usernames, matrix_path=MATRIX_PATH, usernames_path=USERNAMES_PATH):
+    """
+    Saves a document × topic count matrix (any scipy sparse matrix or dense array) and the username of each of
+    its rows.
+    """
+    matrix = sp.csr_matrix(matrix)
+    if matrix.shape[0] != len(usernames):
+        raise ValueError(f"Mismatch : {len(usernames)} usernames vs {matrix.shape[0]} rows in the matrix")
+    sp.save_npz(matrix_path, matrix)
+    np.savez_compressed(usernames_path, usernames=np.asarray(usernames, dtype=str))
+
+
+def load_doc_topic_matrix(matrix_path=MATRIX_PATH, usernames_path=USERNAMES_PATH):
+    """
+    Returns:
+        - the document × topic count matrix (scipy.sparse CSR matrix)
+        - the username of each document (numpy array of strings)
+    """
+    matrix = sp.load_npz(matrix_path).tocsr()
+    with np.load(usernames_path) as f:
+        usernames = f["usernames"]
+    if matrix.shape[0] != len(usernames):
+        raise ValueError(f"Mismatch : {len(usernames)} usernames vs {matrix.shape[0]} rows in {matrix_path}")
+    return matrix, usernames
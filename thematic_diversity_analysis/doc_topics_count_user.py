@@ -1,39 +1,94 @@
 import gzip
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 
-# Step 1: retrieve usernames from corpus.txt
-usernames = []
-with open("corpus.txt", "r", encoding="utf-8") as f:
-    for line in f:
-        parts = line.strip().split("\t")
-        if len(parts) == 3:
-            usernames.append(parts[0])
-        else:
-            raise ValueError(f"Badly formed line in corpus.txt: {line.strip()}")
-
-# Step 2: read state.mallet.gz and parse word by word
-with gzip.open("state.mallet.gz", "rt", encoding="utf-8") as f:
-    lines = [line for line in f if not line.startswith("#")]
-
-columns = ["doc", "source", "pos", "typeindex", "type", "topic"]
-df = pd.DataFrame([line.strip().split() for line in lines], columns=columns)
-df["doc"] = df["doc"].astype(int)
-df["topic"] = df["topic"].astype(int)
-
-# Step 3: build tweet × topic matrix
-D = df["doc"].max() + 1
-T = df["topic"].max() + 1
-doc_topic_counts = np.zeros((D, T), dtype=int)
-
-for row in df.itertuples():
-    doc_topic_counts[row.doc, row.topic] += 1
-
-# Step 4: associate usernames
-if len(usernames) != D:
-    raise ValueError(f"Mismatch : {len(usernames)} usernames vs {D} documents in state.mallet.gz")
-
-df_topics = pd.DataFrame(doc_topic_counts, columns=[f"topic_{i}" for i in range(T)])
-df_topics.insert(0, "username", usernames)
-
-df_topics.to_csv("tweet_topic_matrix_with_users.csv", index=False)
+from thematic_diversity_analysis.doc_topic_matrix import save_doc_topic_matrix
+
+CORPUS_PATH = "corpus.txt"
+STATE_PATH = "state.mallet.gz"
+CHUNK_SIZE = 1000000  # Number of token assignments of state.mallet.gz read at once
+
+# Retrieve usernames from corpus.txt (one document per line)
+def read_corpus_usernames(path=CORPUS_PATH):
+    usernames = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.strip().split("\t")
+            if len(parts) == 3:
+                usernames.append(parts[0])
+            else:
+                raise ValueError(f"Badly formed line in corpus.txt: {line.strip()}")
+    return usernames
+
+def read_state_header(path=STATE_PATH):
+    """
+    Returns the number of header lines of a MALLET state file (starting with "#") and the number of topics,
+    given by the number of values of the "#alpha" line.
+    """
+    header_lines = 0
+    n_topics = None
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if not line.startswith("#"):
+                break
+            header_lines += 1
+            if line.startswith("#alpha"):
+                n_topics = len(line.split(":", 1)[1].split())
+    if n_topics is None:
+        raise ValueError(f"No #alpha line in the header of {path}")
+    return header_lines, n_topics
+
+def count_doc_topics(path=STATE_PATH, chunk_size=CHUNK_SIZE):
+    """
+    Counts the tokens assigned to each topic in each document of a MALLET state file.
+
+    The file is streamed by chunks of chunk_size lines, of which only the "doc" and "topic" columns are parsed,
+    as integers. The assignments of a chunk are counted at once with np.bincount, on the flattened
+    (doc, topic) index. MALLET writes the tokens document by document, so a chunk only spans a few documents,
+    and only its non-zero counts are kept: memory is bounded by the chunk size and the number of non-zero counts.
+
+    Returns:
+        - the document × topic count matrix, as a scipy.sparse CSR matrix (one row per document up to the last
+          one, one column per topic up to the last one assigned)
+    """
+    header_lines, n_topics = read_state_header(path)
+    rows, columns, counts = [], [], []  # Non-zero counts of each chunk
+    max_doc = max_topic = -1
+
+    chunks = pd.read_csv(path, sep=r"\s+", header=None, skiprows=header_lines, usecols=[0, 5], names=["doc", "topic"],
+                         dtype=np.int64, chunksize=chunk_size, compression="gzip", engine="c")
+    for chunk in chunks:
+        docs = chunk["doc"].to_numpy()
+        topics = chunk["topic"].to_numpy()
+        if topics.min() < 0 or topics.max() >= n_topics:
+            raise ValueError(f"Topic out of range in {path}: the #alpha line defines {n_topics} topics")
+
+        first_doc, last_doc = docs.min(), docs.max()
+        max_doc = max(max_doc, last_doc)
+        max_topic = max(max_topic, topics.max())
+
+        chunk_counts = np.bincount((docs - first_doc) * n_topics + topics)
+        positions = np.flatnonzero(chunk_counts)
+        rows.append(first_doc + positions // n_topics)
+        columns.append(positions % n_topics)
+        counts.append(chunk_counts[positions].astype(np.int32))
+
+    # The counts of a document split between two chunks are summed by the conversion to CSR
+    matrix = sp.coo_matrix((np.concatenate(counts), (np.concatenate(rows), np.concatenate(columns))),
+                           shape=(max_doc + 1, max_topic + 1))
+    return matrix.tocsr()
+
+if __name__ == "__main__":
+    # Step 1: retrieve usernames from corpus.txt
+    usernames = read_corpus_usernames()
+
+    # Step 2: build tweet × topic matrix from state.mallet.gz
+    doc_topic_counts = count_doc_topics()
+    D = doc_topic_counts.shape[0]
+
+    # Step 3: associate usernames and save the sparse matrix
+    if len(usernames) != D:
+        raise ValueError(f"Mismatch : {len(usernames)} usernames vs {D} documents in state.mallet.gz")
+
+    save_doc_topic_matrix(doc_topic_counts, usernames)
@@ -1,18 +1,61 @@
+from analysis_cache import load_analysis_table
+from concurrent.futures import ProcessPoolExecutor
 from DB_connection import DB_connection
+from instrumentation import call, stage
+from itertools import repeat
+from lexical_cache import LexicalCache
+import multiprocessing
 import nltk
 from nltk.corpus import stopwords
+import os
 import pickle
 import re
 import stanza
+import time
 import torch
-
-# Downloads
-nltk.download('stopwords')
-stanza.download('en')
-
-# NLP setup
-nlp_stanza = stanza.Pipeline('en', processors='tokenize,lemma', use_gpu=torch.cuda.is_available())
-stop_words = set(stopwords.words('english'))
+from tqdm import tqdm
+import zlib
+
+BATCH_SIZE = 256  # Number of tweets sent to stanza at once
+# Number of worker processes, each with its own stanza pipeline (1: users are processed in the main process)
+MAX_WORKERS = 1 if torch.cuda.is_available() else os.cpu_count()
+SHARDS_PER_WORKER = 4  # Users are hash-partitioned into MAX_WORKERS * SHARDS_PER_WORKER shards
+OUTPUT_PATH = "preprocessed_by_user.pkl"
+
+# Lemmatized text of every cleaned tweet already processed, reused between runs (cleared when stanza changes)
+LEMMA_CACHE_PATH = "lemma_cache.pkl"
+LEMMA_CACHE_SIZE = 2000000  # Maximum number of tweets kept in the cache
+USE_LEMMA_CACHE = True
+lemma_cache = LexicalCache(maxsize=LEMMA_CACHE_SIZE, enabled=USE_LEMMA_CACHE)
+
+# Stanza pipeline and stop words, initialised once per process by init_resources()
+nlp_stanza = None
+stop_words = None
+
+def init_resources(download=True, load_pipeline=True, load_cache=True):
+    """
+    Downloads the resources and loads the stop words, the stanza pipeline (only needed by the processes which run
+    stanza) and the lemma cache (only needed by the main process, which looks the tweets up before sharding them).
+    """
+    global nlp_stanza, stop_words
+
+    # Downloads
+    if download:
+        nltk.download('stopwords')
+        stanza.download('en')
+
+    # NLP setup
+    if load_pipeline:
+        nlp_stanza = stanza.Pipeline('en', processors='tokenize,lemma', use_gpu=torch.cuda.is_available())
+    stop_words = set(stopwords.words('english'))
+
+    if load_cache:
+        lemma_cache.load(LEMMA_CACHE_PATH, signature=(stanza.__version__, len(stop_words)))
+
+# Initialiser of the worker processes: torch threads are shared out between the workers to avoid oversubscription
+def init_worker(torch_threads):
+    torch.set_num_threads(torch_threads)
+    init_resources(download=False, load_cache=False)
 
 # Basic cleaning
 def basic_clean(text):
@@ -20,10 +63,8 @@ def basic_clean(text):
     text = ''.join(c if c.isalnum() or c.isspace() else ' ' for c in text)
     return text
 
-# Preprocessing function
-def preprocess_text(text):
-    text = basic_clean(text)
-    doc = nlp_stanza(text)
+# Lemmas of a processed stanza document, without stop words, numbers and single characters
+def lemmas_from_doc(doc):
     tokens = [
         word.lemma.strip()
         for sent in doc.sentences
@@ -35,44 +76,141 @@ def preprocess_text(text):
     ]
     return " ".join(tokens)
 
-# Load DB
-db_connection = DB_connection("GOSSIPCOP")
-df_db = db_connection.select(
-    "SELECT username, text_translation, quoted_translation, tweet_type FROM filtered_user_timelines"
-).fillna("")
-
-usernames = df_db['username'].unique()
-
-preprocessed_by_user = {}
-
-# Process all users
-for idx, username in enumerate(usernames, 1):
-    user_df = df_db[df_db['username'] == username][['text_translation', 'quoted_translation', 'tweet_type']]
-
-    user_processed = {}
+def lemmatize_batches(cleaned_texts, batch_size=BATCH_SIZE, show_progress=True):
+    """
+    Runs stanza on the cleaned texts, "batch_size" documents at a time, and returns their lemmatized versions.
+    """
+    lemmatized = []
+    with tqdm(total=len(cleaned_texts), unit="tweet", disable=not show_progress) as progress:
+        for i in range(0, len(cleaned_texts), batch_size):
+            batch = cleaned_texts[i:i + batch_size]
+            with call("stanza.pipeline"):
+                docs = nlp_stanza([stanza.Document([], text=text) for text in batch])
+            lemmatized.extend(lemmas_from_doc(doc) for doc in docs)
+            progress.update(len(batch))
+    return lemmatized
+
+def lemmatize_cached(cleaned_texts, lemmatize):
+    """
+    Returns the lemmatized versions of the cleaned texts. Texts in the lemma cache (repeated tweets, retweets...)
+    are not lemmatized again: the others are passed to lemmatize(texts), in a single call.
+    """
+    if not lemma_cache.enabled:
+        return lemmatize(cleaned_texts)
+    return lemma_cache.cache("lemmas").get_or_compute_many(cleaned_texts, lemmatize)
+
+def preprocess_texts(texts, batch_size=BATCH_SIZE, show_progress=True):
+    """
+    Pre-processes a list of tweets. Tweets whose cleaned text is in the lemma cache are not sent to stanza again.
+    """
+    cleaned_texts = [basic_clean(text) for text in texts]
+    return lemmatize_cached(cleaned_texts, lambda missing: lemmatize_batches(missing, batch_size, show_progress))
 
-    for tweet_type in user_df['tweet_type'].unique():
-        subset = user_df[user_df['tweet_type'] == tweet_type]
-
-        if tweet_type == "quoted_tweet":
-            texts = [
-                f"{row['text_translation']} {row['quoted_translation']}".strip()
-                for _, row in subset.iterrows()
-            ]
-        else:
-            texts = subset['text_translation'].tolist()
-
-        preprocessed = [preprocess_text(t) for t in texts if t.strip()]
-        preprocessed = [t for t in preprocessed if t.strip()]
-
-        if preprocessed:
-            user_processed[tweet_type] = preprocessed
-
-    if user_processed:
-        preprocessed_by_user[username] = user_processed
-
-# Save results
-with open("preprocessed_by_user.pkl", "wb") as f:
-    pickle.dump(preprocessed_by_user, f)
-
-db_connection.close()
+# Preprocessing function
+def preprocess_text(text):
+    return preprocess_texts([text])[0]
+
+def collect_user_texts(df_db):
+    """
+    Returns the non-empty texts of every user and tweet type: [(username, tweet_type, texts)], in the order in
+    which users and tweet types first appear in df_db. The text of a quoted tweet is followed by the quoted text.
+    """
+    user_texts = []
+    for username, user_df in df_db.groupby('username', sort=False):
+        for tweet_type, subset in user_df.groupby('tweet_type', sort=False):
+            if tweet_type == "quoted_tweet":
+                texts = (subset['text_translation'] + " " + subset['quoted_translation']).str.strip().tolist()
+            else:
+                texts = subset['text_translation'].tolist()
+            user_texts.append((username, tweet_type, [t for t in texts if t.strip()]))
+    return user_texts
+
+# Shard of a user: crc32 is stable across runs and processes, unlike hash()
+def shard_of(username, shard_count):
+    return zlib.crc32(username.encode("utf-8")) % shard_count
+
+# Lemmatizes cleaned texts in a worker process (the lemma cache is looked up by the main process)
+def lemmatize_shard(cleaned_texts, batch_size):
+    return lemmatize_batches(cleaned_texts, batch_size, show_progress=False)
+
+def lemmatize_sharded(cleaned_texts, usernames, batch_size, max_workers, shards_per_worker=SHARDS_PER_WORKER):
+    """
+    Lemmatizes cleaned texts in max_workers processes. The texts are hash-partitioned into shards by the user who
+    posted them (usernames[i] for cleaned_texts[i]), so all the texts of a user are processed by the same worker.
+    The results are put back in the order of cleaned_texts.
+    """
+    shard_count = max_workers * shards_per_worker
+    shards = [[] for _ in range(shard_count)]  # Positions in cleaned_texts of the texts of each shard
+    for position, username in enumerate(usernames):
+        shards[shard_of(username, shard_count)].append(position)
+    shard_texts = [[cleaned_texts[position] for position in shard] for shard in shards]
+
+    # Workers are spawned rather than forked: forking a process in which torch has started its threads can hang
+    torch_threads = max(1, os.cpu_count() // max_workers)
+    lemmatized = [None] * len(cleaned_texts)
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=init_worker, initargs=(torch_threads,)) as executor:
+        results = executor.map(lemmatize_shard, shard_texts, repeat(batch_size))
+        for shard, shard_lemmatized in tqdm(zip(shards, results), total=shard_count, unit="shard"):
+            for position, text in zip(shard, shard_lemmatized):
+                lemmatized[position] = text
+    return lemmatized
+
+def preprocess_all_users(df_db, batch_size=BATCH_SIZE, max_workers=MAX_WORKERS):
+    """
+    Pre-processes the tweets of every user of df_db (columns "username", "text_translation", "quoted_translation"
+    and "tweet_type"). The lemma cache is looked up in this process; with one process, all the other tweets are
+    lemmatized together, so that stanza always receives full batches, otherwise they are sharded by user between
+    max_workers processes (see lemmatize_sharded). The output is the same in both cases.
+
+    Returns:
+        - {username: {tweet_type: [pre-processed tweets]}}, without empty tweets, tweet types and users
+    """
+    user_texts = collect_user_texts(df_db)
+    if max_workers <= 1:
+        preprocessed = preprocess_texts([text for _, _, texts in user_texts for text in texts], batch_size)
+    else:
+        cleaned_texts = []
+        owners = {}  # User of each cleaned text: a text posted by several users is sharded with the first one
+        for username, _, texts in user_texts:
+            for text in texts:
+                cleaned_text = basic_clean(text)
+                cleaned_texts.append(cleaned_text)
+                owners.setdefault(cleaned_text, username)
+        preprocessed = lemmatize_cached(
+            cleaned_texts,
+            lambda missing: lemmatize_sharded(missing, [owners[text] for text in missing], batch_size, max_workers),
+        )
+    preprocessed = iter(preprocessed)
+
+    preprocessed_by_user = {}
+    for username, tweet_type, texts in user_texts:
+        user_preprocessed = [t for t in (next(preprocessed) for _ in texts) if t.strip()]
+        if user_preprocessed:
+            preprocessed_by_user.setdefault(username, {})[tweet_type] = user_preprocessed
+    return preprocessed_by_user
+
+if __name__ == "__main__":
+    # When users are sharded, stanza only runs in the worker processes
+    init_resources(load_pipeline=MAX_WORKERS <= 1)
+
+    # Load DB
+    db_connection = DB_connection("GOSSIPCOP", read_only=True)
+    df_db = load_analysis_table(
+        db_connection, "timelines", columns=["username", "text_translation", "quoted_translation", "tweet_type"]
+    ).fillna("")
+    db_connection.close()
+
+    # Process all users
+    start = time.perf_counter()
+    with stage("thematic.preprocess", rows=len(df_db), users=df_db['username'].nunique()):
+        preprocessed_by_user = preprocess_all_users(df_db)
+    seconds = time.perf_counter() - start
+    print(f"{len(df_db)} tweets pre-processed in {seconds:.1f}s ({len(df_db) / seconds:.1f} tweets/s)")
+
+    lemma_cache.save()
+    lemma_cache.print_stats()
+
+    # Save results
+    with open(OUTPUT_PATH, "wb") as f:
+        pickle.dump(preprocessed_by_user, f)
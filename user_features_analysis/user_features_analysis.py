@@ -1,116 +1,55 @@
-from datetime import datetime
-import json
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from scipy.stats import shapiro, probplot, ttest_ind, mannwhitneyu, skew
 import seaborn as sns
 
+from analysis_cache import load_analysis_table
 from DB_connection import DB_connection
 
 sns.set(style="whitegrid")
 
-def get_valid_usernames(db_connection):
-    query = "SELECT DISTINCT username FROM filtered_user_timelines"
-    df = db_connection.select(query)
-    return set(df["username"])
-
-def load_user_data(db_connection, valid_usernames):
-    query = "SELECT username, label, full_data FROM users"
-    rows = db_connection.select(query).values.tolist()
-
-    users_data = []
-    skipped = 0
-
-    for username, label, full_data in rows:
-        if username not in valid_usernames:
-            continue
-        try:
-            if full_data is None:
-                raise ValueError("Missing full_data")
-            data = json.loads(full_data)
-
-            verified = data.get("verification", {}).get("is_blue_verified", False)
-            created_at_str = data.get("core", {}).get("created_at", None)
-            created_at = datetime.strptime(created_at_str, "%a %b %d %H:%M:%S %z %Y") if created_at_str else None
-            days_since_registration = (datetime.now(datetime.utcnow().astimezone().tzinfo) - created_at).days if created_at else None
-
-            status_count = data.get("tweet_counts", {}).get("tweets", None)
-            favor_count = data.get("action_counts", {}).get("favorites_count", None)
-            follower_count = data.get("relationship_counts", {}).get("followers", None)
-            following_count = data.get("relationship_counts", {}).get("following", None)
-            tff_ratio = (follower_count + 1) / (following_count + 1) if follower_count is not None and following_count is not None else None
-
-            users_data.append({
-                "username": username,
-                "label": label,
-                "verified": verified,
-                "register_days_ago": days_since_registration,
-                "status_count": status_count,
-                "favor_count": favor_count,
-                "follower_count": follower_count,
-                "following_count": following_count,
-                "tff_ratio": tff_ratio
-            })
-
-        except Exception as e:
-            print(f"Skipping {username} due to error: {e}")
-            skipped += 1
-
-    print(f"Total processed users: {len(users_data)}")
+TWITTER_DATE_FORMAT = "%a %b %d %H:%M:%S %z %Y"
+
+def load_user_data(db_connection):
+    # The JSON fields come from the generated columns of the users table (see data_collection/json_features.py)
+    df = load_analysis_table(db_connection, "users").rename(columns={"tweet_count": "status_count"})
+
+    skipped = int((df["has_data"] == 0).sum())
+    df = df[df["has_data"] == 1].drop(columns="has_data").reset_index(drop=True)
+
+    df["verified"] = df.pop("is_blue_verified").fillna(False).astype(bool)
+    created_at = pd.to_datetime(df.pop("account_created_at"), format=TWITTER_DATE_FORMAT, utc=True, errors="coerce")
+    df["register_days_ago"] = (pd.Timestamp.now(tz="UTC") - created_at).dt.days
+    df["tff_ratio"] = (df["follower_count"] + 1) / (df["following_count"] + 1)
+
+    df = df[["username", "label", "verified", "register_days_ago", "status_count", "favor_count",
+             "follower_count", "following_count", "tff_ratio"]]
+
+    print(f"Total processed users: {len(df)}")
     print(f"Total skipped users: {skipped}")
-    return pd.DataFrame(users_data)
+    return df
 
 def run_tweet_related_analysis(db_connection):
-    df_tweets = db_connection.select("SELECT username, label, full_data FROM filtered_user_timelines")
-
-    tweeting_times = {}
-    reply_counts = {}
-    retweet_counts = {}
-
-    for _, row in df_tweets.iterrows():
-        username = row["username"]
-        label = row["label"]
-        try:
-            tweet_data = json.loads(row["full_data"])
-            created_at_str = tweet_data.get("created_at", None)
-            reply = tweet_data.get("replies", None)
-            retweet = tweet_data.get("retweets", None)
-
-            if username not in tweeting_times:
-                tweeting_times[username] = {"dates": [], "label": label}
-                reply_counts[username] = []
-                retweet_counts[username] = []
-
-            if created_at_str:
-                created_at = datetime.strptime(created_at_str, "%a %b %d %H:%M:%S %z %Y")
-                tweeting_times[username]["dates"].append(created_at)
-
-            if reply is not None:
-                reply_counts[username].append(reply)
-            if retweet is not None:
-                retweet_counts[username].append(retweet)
-
-        except Exception:
-            continue
-
-    tweet_metrics = []
-    for username in tweeting_times:
-        dates = tweeting_times[username]["dates"]
-        label = tweeting_times[username]["label"]
-        tweeting_range = (max(dates) - min(dates)).days if len(dates) >= 2 else None
-        mean_replies = np.mean(reply_counts[username]) if reply_counts[username] else None
-        mean_retweets = np.mean(retweet_counts[username]) if retweet_counts[username] else None
-
-        tweet_metrics.append({
-            "username": username,
-            "label": label,
-            "tweeting_range_days": tweeting_range,
-            "mean_replies": mean_replies,
-            "mean_retweets": mean_retweets
-        })
-
-    return pd.DataFrame(tweet_metrics)
+    # The JSON fields are materialized in filtered_user_timelines (see data_collection/filter_user_timelines.py)
+    df_tweets = load_analysis_table(db_connection, "timelines",
+                                    columns=["username", "label", "tweet_created_at", "replies", "retweets"])
+    df_tweets["created_at"] = pd.to_datetime(df_tweets["tweet_created_at"], format=TWITTER_DATE_FORMAT, utc=True, errors="coerce")
+
+    grouped = df_tweets.groupby("username", sort=False)
+    tweet_metrics = grouped.agg(
+        label=("label", "first"),
+        first_date=("created_at", "min"),
+        last_date=("created_at", "max"),
+        date_count=("created_at", "count"),
+        mean_replies=("replies", "mean"),
+        mean_retweets=("retweets", "mean"),
+    ).reset_index()
+
+    tweet_metrics["tweeting_range_days"] = (tweet_metrics["last_date"] - tweet_metrics["first_date"]).dt.days
+    tweet_metrics.loc[tweet_metrics["date_count"] < 2, "tweeting_range_days"] = np.nan
+
+    return tweet_metrics[["username", "label", "tweeting_range_days", "mean_replies", "mean_retweets"]]
 
 def t_test_and_print(group1, group2, label):
     g1, g2 = group1.dropna(), group2.dropna()
@@ -392,9 +331,8 @@ def analyze_tweet_metrics(df):
 
 
 if __name__ == "__main__":
-    db_connection = DB_connection("GOSSIPCOP")
-    valid_usernames = get_valid_usernames(db_connection)
-    df_users = load_user_data(db_connection, valid_usernames)
+    db_connection = DB_connection("GOSSIPCOP", read_only=True)
+    df_users = load_user_data(db_connection)
     df_tweet_metrics = run_tweet_related_analysis(db_connection)
     db_connection.close()
 